@@ -0,0 +1,287 @@
+"""Supplier analytics: hourly and daily rollups of likes, comments and messages.
+
+Raw events are read from ``product_likes``, ``comments`` and ``messages``
+past each table's watermark (the latest ``created_at`` already rolled up),
+keyset-paged on ``created_at``, and each page is aggregated with pandas into
+hourly buckets per ``(supplier_id, product_id)``; daily buckets are derived
+from the hourly ones. Counts are additive, so page rollups are merged into the
+stored ones. Every ``ANALYTICS_BATCH_SIZE`` events the rollups and watermarks
+are saved, so memory stays bounded by the rollups rather than the backlog and
+an interrupted run resumes from its last batch. Rollups live in Parquet files
+under ``ANALYTICS_DIR`` with the watermarks beside them, and are replaced
+atomically.
+
+Events newer than ``ANALYTICS_LAG_SECONDS`` are left for the next run, so rows
+committed slightly out of order are not skipped by the watermark. Messages
+are attributed to their recipient, and to the product when they mention one;
+supplier-level rows use an empty ``product_id``.
+
+Messages are only visible to their participants under row-level security,
+so updates read with ``SUPABASE_SERVICE_KEY`` when it is set. Run
+``python analytics.py`` to update once (e.g. from cron); the API server also
+updates periodically, with a file lock so one worker does the work.
+"""
+import fcntl
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+ANALYTICS_DIR = Path(os.getenv("ANALYTICS_DIR", Path(__file__).parent / "analytics_data"))
+ANALYTICS_LAG_SECONDS = int(os.getenv("ANALYTICS_LAG_SECONDS", "60"))
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "50000"))
+PAGE_SIZE = 1000
+METRICS = ["likes", "comments", "messages"]
+KEYS = ["supplier_id", "product_id", "bucket"]
+EPOCH = "1970-01-01T00:00:00+00:00"
+
+# table -> (metric, columns to read)
+SOURCES = {
+    "product_likes": ("likes", "product_id, created_at"),
+    "comments": ("comments", "product_id, created_at"),
+    "messages": ("messages", "product_id, recipient_id, created_at"),
+}
+
+
+def create_reader():
+    """Client for the update job, with the service key when available."""
+    from supabase import create_client
+
+    return create_client(os.environ["SUPABASE_URL"], os.getenv("SUPABASE_SERVICE_KEY") or os.environ["SUPABASE_KEY"])
+
+
+def _empty_rollup() -> pd.DataFrame:
+    frame = pd.DataFrame({
+        "supplier_id": pd.Series(dtype="string"),
+        "product_id": pd.Series(dtype="string"),
+        "bucket": pd.Series(dtype="datetime64[ns, UTC]"),
+    })
+    for metric in METRICS:
+        frame[metric] = pd.Series(dtype="int32")
+    return frame
+
+
+class AnalyticsStore:
+    def __init__(self, directory: Path = ANALYTICS_DIR):
+        self.directory = Path(directory)
+        self._cache: Dict[str, Any] = {}
+
+    def path(self, name: str) -> Path:
+        return self.directory / name
+
+    # Update ------------------------------------------------------------
+
+    def _watermarks(self) -> Dict[str, str]:
+        try:
+            return json.loads(self.path("watermarks.json").read_text())
+        except FileNotFoundError:
+            return {}
+
+    def _read(self, granularity: str) -> pd.DataFrame:
+        path = self.path(f"{granularity}.parquet")
+        if not path.exists():
+            return _empty_rollup()
+        return pd.read_parquet(path)
+
+    def _write(self, name: str, writer) -> None:
+        tmp = self.path(name + ".tmp")
+        writer(tmp)
+        os.replace(tmp, self.path(name))
+
+    @staticmethod
+    def _pages(supabase, table: str, columns: str, after: str, until: str) -> Iterator[List[Dict[str, Any]]]:
+        """Rows past ``after`` up to ``until`` in ``created_at`` order, a page at a time.
+
+        Each page starts after the last ``created_at`` of the previous one. A
+        full page may end partway through rows sharing that timestamp, so they
+        are read again in full before moving past it.
+        """
+        while True:
+            page = (
+                supabase.table(table).select(columns)
+                .gt("created_at", after).lte("created_at", until)
+                .order("created_at").limit(PAGE_SIZE)
+                .execute()
+            ).data
+            if len(page) < PAGE_SIZE:
+                if page:
+                    yield page
+                return
+            after = page[-1]["created_at"]
+            ties = supabase.table(table).select(columns).eq("created_at", after).execute().data
+            yield [row for row in page if row["created_at"] != after] + ties
+
+    @staticmethod
+    def _product_suppliers(supabase, product_ids: List[str]) -> Dict[str, str]:
+        owners: Dict[str, str] = {}
+        for start in range(0, len(product_ids), 200):
+            chunk = product_ids[start:start + 200]
+            response = supabase.table("products").select("id, supplier_id").in_("id", chunk).execute()
+            owners.update({row["id"]: row["supplier_id"] for row in response.data})
+        return owners
+
+    def _events(self, supabase, metric: str, rows: List[Dict[str, Any]], owners: Dict[str, Any]) -> pd.DataFrame:
+        """One page of ``metric`` rows attributed to suppliers.
+
+        ``owners`` caches product -> supplier across pages, with ``None`` for
+        products that no longer exist.
+        """
+        events = pd.DataFrame(rows)
+        events["metric"] = metric
+        if metric == "messages":
+            # Messages belong to whoever received them
+            events["supplier_id"] = events["recipient_id"].astype("string")
+        else:
+            unknown = [p for p in events["product_id"].dropna().unique().tolist() if p not in owners]
+            owners.update(dict.fromkeys(unknown))
+            owners.update(self._product_suppliers(supabase, unknown))
+            product_owners = pd.Series(owners, dtype="string")
+            # astype: with no known product, map gives a float64 column of NaN
+            events["supplier_id"] = events["product_id"].map(product_owners).astype("string")
+        events["product_id"] = events["product_id"].fillna("")
+        return events.dropna(subset=["supplier_id"])[["supplier_id", "product_id", "created_at", "metric"]]
+
+    @staticmethod
+    def rollup(events: pd.DataFrame, freq: str) -> pd.DataFrame:
+        """Count events per (supplier, product, bucket) and metric."""
+        if events.empty:
+            return _empty_rollup()
+        buckets = pd.to_datetime(events["created_at"], utc=True, format="ISO8601").dt.floor(freq)
+        counts = (
+            events.assign(bucket=buckets)
+            .groupby(KEYS + ["metric"], observed=True).size()
+            .unstack("metric", fill_value=0)
+            .reindex(columns=METRICS, fill_value=0)
+            .astype("int32")
+            .reset_index()
+        )
+        counts.columns.name = None
+        return counts.astype({"supplier_id": "string", "product_id": "string"})
+
+    @staticmethod
+    def merge(existing: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+        if new.empty:
+            return existing
+        combined = pd.concat([existing, new], ignore_index=True)
+        return (
+            combined.groupby(KEYS, observed=True)[METRICS].sum()
+            .astype("int32").reset_index()
+            .sort_values(["supplier_id", "bucket"], kind="stable", ignore_index=True)
+        )
+
+    def _save(
+        self, hourly: pd.DataFrame, daily: pd.DataFrame, batch: List[pd.DataFrame], watermarks: Dict[str, str]
+    ) -> Tuple[pd.DataFrame, pd.DataFrame, int]:
+        """Merge a batch of page rollups into the stored ones, then advance the watermarks."""
+        buckets = 0
+        if batch:
+            hourly_new = pd.concat(batch, ignore_index=True)
+            buckets = len(hourly_new.drop_duplicates(KEYS))
+            daily_new = hourly_new.assign(bucket=hourly_new["bucket"].dt.floor("D"))
+            hourly, daily = self.merge(hourly, hourly_new), self.merge(daily, daily_new)
+            self._write("hourly.parquet", lambda p: hourly.to_parquet(p, index=False, compression="zstd"))
+            self._write("daily.parquet", lambda p: daily.to_parquet(p, index=False, compression="zstd"))
+        self._write("watermarks.json", lambda p: p.write_text(json.dumps(watermarks)))
+        return hourly, daily, buckets
+
+    def update(self, supabase) -> Dict[str, Any]:
+        """Roll up events past the watermarks; return what was processed.
+
+        Returns ``{"skipped": True}`` when another process holds the lock.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.path(".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return {"skipped": True}
+
+            watermarks = self._watermarks()
+            until = (datetime.now(timezone.utc) - timedelta(seconds=ANALYTICS_LAG_SECONDS)).isoformat()
+            hourly, daily = self._read("hourly"), self._read("daily")
+            owners: Dict[str, Any] = {}
+            batch: List[pd.DataFrame] = []
+            pending = processed = buckets = 0
+            for table, (metric, columns) in SOURCES.items():
+                for rows in self._pages(supabase, table, columns, watermarks.get(table, EPOCH), until):
+                    events = self._events(supabase, metric, rows, owners)
+                    if not events.empty:
+                        batch.append(self.rollup(events, "h"))
+                    watermarks[table] = rows[-1]["created_at"]
+                    processed += len(events)
+                    pending += len(rows)
+                    if pending >= ANALYTICS_BATCH_SIZE:
+                        hourly, daily, saved = self._save(hourly, daily, batch, watermarks)
+                        buckets += saved
+                        batch, pending = [], 0
+            hourly, daily, saved = self._save(hourly, daily, batch, watermarks)
+            return {"events": processed, "buckets": buckets + saved, "watermarks": watermarks}
+
+    # Queries -----------------------------------------------------------
+
+    def _load(self, granularity: str) -> Optional[pd.DataFrame]:
+        """Rollup indexed by supplier, reloaded only when the file changes."""
+        path = self.path(f"{granularity}.parquet")
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = self._cache.get(granularity)
+        if cached is None or cached[0] != mtime:
+            frame = pd.read_parquet(path).set_index("supplier_id").sort_index()
+            cached = self._cache[granularity] = (mtime, frame)
+        return cached[1]
+
+    def supplier_stats(
+        self,
+        supplier_id: str,
+        granularity: str,
+        start: datetime,
+        end: datetime,
+        product_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        frame = self._load(granularity)
+        empty = {"totals": {m: 0 for m in METRICS}, "series": [], "products": []}
+        if frame is None or supplier_id not in frame.index:
+            return empty
+
+        rows = frame.loc[[supplier_id]]
+        in_range = (rows["bucket"] >= pd.Timestamp(start)) & (rows["bucket"] < pd.Timestamp(end))
+        if product_id is not None:
+            in_range &= rows["product_id"] == product_id
+        rows = rows[in_range.to_numpy()]
+        if rows.empty:
+            return empty
+
+        series = rows.groupby("bucket")[METRICS].sum().sort_index()
+        products = (
+            rows[rows["product_id"] != ""].groupby("product_id")[METRICS].sum()
+            .assign(total=lambda df: df[METRICS].sum(axis=1))
+            .sort_values("total", ascending=False)
+        )
+        totals = rows[METRICS].sum()
+        return {
+            "totals": {m: int(totals[m]) for m in METRICS},
+            "series": [
+                {"bucket": bucket.isoformat(), **{m: int(v) for m, v in zip(METRICS, values)}}
+                for bucket, values in zip(series.index, series.to_numpy(dtype=np.int64))
+            ],
+            "products": [
+                {"product_id": pid, **{m: int(v) for m, v in zip(METRICS, values)}}
+                for pid, values in zip(products.index, products[METRICS].to_numpy(dtype=np.int64))
+            ],
+        }
+
+
+analytics_store = AnalyticsStore()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / ".env")
+    print(json.dumps(analytics_store.update(create_reader()), indent=2, default=str))
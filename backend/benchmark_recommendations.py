@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Latency benchmark for the similar-products index.
+
+Builds a SimilarityIndex over a synthetic catalog (default 100k products)
+and times single and batched top-k queries, incremental upserts and a full
+rebuild.
+
+    python benchmark_recommendations.py [--products 100000] [--queries 500]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from recommendations import DIM, SimilarityIndex
+
+WORDS = {
+    "Électronique": "téléphone smartphone écran chargeur batterie samsung tecno casque radio télévision",
+    "Mode": "robe pagne wax chemise pantalon chaussures sac boubou tissu bazin",
+    "Maison & Jardin": "marmite ventilateur matelas chaise table lampe seau natte réchaud",
+    "Alimentation": "riz huile manioc poisson fumé arachide farine sucre café cacao",
+    "Santé & Beauté": "savon karité crème parfum mèches tresses lotion beurre huile",
+    "Automobile": "pneu batterie huile moteur pièces moto filtre phare bougie",
+}
+PLACES = {
+    "Cameroun": ["Yaoundé", "Douala", "Bafoussam"],
+    "Sénégal": ["Dakar", "Thiès", "Kaolack"],
+    "RDC": ["Kinshasa", "Lubumbashi", "Goma"],
+    "Côte d'Ivoire": ["Abidjan", "Bouaké"],
+}
+
+
+def synthetic_catalog(n):
+    products = []
+    for i in range(n):
+        category = random.choice(list(WORDS))
+        vocabulary = WORDS[category].split()
+        country = random.choice(list(PLACES))
+        products.append({
+            "id": f"p{i}",
+            "name": " ".join(random.sample(vocabulary, 3)),
+            "description": " ".join(random.choices(vocabulary, k=15)) + " livraison rapide qualité garantie",
+            "category": category,
+            "supplier_country": country,
+            "supplier_city": random.choice(PLACES[country]),
+        })
+    return products
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=32)
+    args = parser.parse_args()
+
+    random.seed(0)
+    catalog = synthetic_catalog(args.products)
+    index = SimilarityIndex()
+
+    start = time.perf_counter()
+    index.rebuild(catalog)
+    print(f"rebuild: {args.products:,} products, dim {DIM}, "
+          f"{index.stats()['matrix_mb']} MB in {time.perf_counter() - start:.2f}s")
+
+    ids = [p["id"] for p in random.sample(catalog, args.queries)]
+    latencies = []
+    for pid in ids:
+        start = time.perf_counter()
+        index.similar(pid, args.k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f"single query: p50 {statistics.median(latencies):.2f} ms, "
+          f"p95 {percentile(latencies, 0.95):.2f} ms, p99 {percentile(latencies, 0.99):.2f} ms")
+
+    start = time.perf_counter()
+    batches = [ids[i:i + args.batch] for i in range(0, len(ids), args.batch)]
+    for batch in batches:
+        index.similar_many(batch, args.k)
+    per_query = (time.perf_counter() - start) * 1000 / len(ids)
+    print(f"batched ({args.batch}/batch): {per_query:.2f} ms per query")
+
+    start = time.perf_counter()
+    for i, product in enumerate(synthetic_catalog(1000)):
+        index.upsert({**product, "id": f"new{i}"})
+    print(f"upsert: {(time.perf_counter() - start):.3f} ms per product")
+
+    sample = catalog[0]
+    print(f"\n{sample['name']!r} ({sample['category']}, {sample['supplier_city']}) ->")
+    by_id = {p["id"]: p for p in catalog}
+    for pid, score in index.similar(sample["id"], 5):
+        if pid in by_id:
+            p = by_id[pid]
+            print(f"  {score:.3f}  {p['name']!r} ({p['category']}, {p['supplier_city']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Startup and throughput benchmark for serve.py.
+
+For each worker count, starts ``serve.py`` and reports how long until
+``/api/health/live`` and ``/api/health/ready`` answer 200, counted from
+process start. That includes the master importing the app once, whose time
+is reported separately. It then drives ``--path`` with ``--clients`` load
+processes for ``--duration`` seconds and reports requests per second.
+Throughput should scale with workers up to the number of cores, less
+whatever the load processes use on the same machine.
+
+Readiness needs the upstream check to pass. ``--stub-upstream`` points the
+workers at a local server that answers every PostgREST request with ``[]``,
+so the ready time measures the worker rather than the network path to
+Supabase; without it the workers use SUPABASE_URL/SUPABASE_KEY.
+
+    python benchmark_serve.py --workers 1,2,4 --stub-upstream
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+
+class EmptyPostgREST(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"[]")
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    return False
+
+
+async def drive(url, concurrency, duration):
+    done = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=10) as client:
+        async def loop():
+            nonlocal done
+            while time.perf_counter() < deadline:
+                response = await client.get(url)
+                if response.status_code == 200:
+                    done += 1
+
+        await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return done
+
+
+def load_process(url, concurrency, duration, results):
+    results.put(asyncio.run(drive(url, concurrency, duration)))
+
+
+def import_seconds(env):
+    """How long importing the app takes, which the master does once before forking."""
+    code = "import time; start = time.perf_counter(); import server; print(time.perf_counter() - start)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=Path(__file__).parent, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.split()[-1])
+
+
+def measure(workers, args, env):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--bind", f"127.0.0.1:{port}"],
+        cwd=Path(__file__).parent, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        live = wait_for(f"{base}/api/health/live", 30) and time.perf_counter() - start
+        ready = wait_for(f"{base}/api/health/ready", 30) and time.perf_counter() - start
+        # Let every worker finish warming up before measuring
+        time.sleep(1)
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=load_process, args=(base + args.path, args.concurrency, args.duration, results)
+            )
+            for _ in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        total = sum(results.get() for _ in clients)
+        for client in clients:
+            client.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+    def seconds(value):
+        return f"{value:.2f}s" if value else "timed out"
+
+    print(f"{workers:>3} workers: live {seconds(live)}, ready {seconds(ready)}, "
+          f"{total / args.duration:,.0f} req/s on {args.path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default=",".join(
+        str(n) for n in sorted({1, 2, multiprocessing.cpu_count()})
+    ))
+    parser.add_argument("--path", default="/api/categories")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=max(1, multiprocessing.cpu_count() // 2))
+    parser.add_argument("--concurrency", type=int, default=32, help="connections per load process")
+    parser.add_argument("--stub-upstream", action="store_true")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.stub_upstream:
+        stub = ThreadingHTTPServer(("127.0.0.1", 0), EmptyPostgREST)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        env.update(SUPABASE_URL=f"http://127.0.0.1:{stub.server_port}", SUPABASE_KEY="stub.stub.stub")
+
+    print(f"{multiprocessing.cpu_count()} cores, {args.clients} load processes x {args.concurrency} connections")
+    print(f"app import (once, in the master): {import_seconds(env):.2f}s")
+    for workers in (int(n) for n in args.workers.split(",")):
+        measure(workers, args, env)
+
+
+if __name__ == "__main__":
+    main()
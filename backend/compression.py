@@ -0,0 +1,210 @@
+"""Response compression middleware.
+
+Product and message payloads carry ``image_base64`` / ``avatar_base64``
+strings, which compress well. This middleware negotiates ``br`` or ``gzip``
+from ``Accept-Encoding``, leaves small bodies alone and moves the
+compression of large bodies and large streamed chunks to a worker thread so
+the event loop keeps serving other requests.
+"""
+import gzip
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+DEFAULT_LEVELS = {"gzip": 6, "br": 5}
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "text/",
+    "application/javascript",
+    "image/svg+xml",
+)
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Return a mapping of coding -> q-value from an Accept-Encoding header."""
+    codings = {}
+    for part in header.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        coding, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[coding.strip().lower()] = q
+    return codings
+
+
+def choose_encoding(header: str) -> Optional[str]:
+    """Pick the best supported encoding the client accepts, or None."""
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get("*", 0.0)
+    candidates = []
+    if brotli is not None:
+        candidates.append("br")
+    candidates.append("gzip")
+
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = codings.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class _StreamCompressor:
+    """Incremental compressor for responses sent in several body messages."""
+
+    def __init__(self, encoding: str, level: int):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+            self._finish = self._compressor.finish
+            self._push = self._compressor.process
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._finish = self._compressor.flush
+            self._push = self._compressor.compress
+
+    def push(self, data: bytes) -> bytes:
+        return self._push(data)
+
+    def finish(self) -> bytes:
+        return self._finish()
+
+
+class CompressionMiddleware:
+    """Compress HTTP responses with brotli or gzip.
+
+    ``minimum_size`` skips bodies too small to benefit. ``route_levels`` maps
+    path prefixes to per-encoding levels, e.g.
+    ``{"/api/products": {"gzip": 5, "br": 4}}``; the longest matching prefix
+    wins and missing encodings fall back to ``levels``. Bodies, and chunks of
+    streamed bodies, of at least ``offload_size`` bytes are compressed in the
+    threadpool.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        offload_size: int = 64 * 1024,
+        levels: Optional[Dict[str, int]] = None,
+        route_levels: Optional[Dict[str, Dict[str, int]]] = None,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+        self.route_levels: List[Tuple[str, Dict[str, int]]] = sorted(
+            (route_levels or {}).items(), key=lambda item: len(item[0]), reverse=True
+        )
+
+    def level_for(self, path: str, encoding: str) -> int:
+        for prefix, levels in self.route_levels:
+            if path.startswith(prefix) and encoding in levels:
+                return levels[encoding]
+        return self.levels[encoding]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        level = self.level_for(scope["path"], encoding)
+        responder = _CompressionResponder(self, encoding, level, send)
+        await self.app(scope, receive, responder)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, level: int, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.level = level
+        self.send = send
+        self.start_message: Optional[Message] = None
+        self.passthrough = False
+        self.stream: Optional[_StreamCompressor] = None
+
+    def _compressible(self, headers: Headers) -> bool:
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "")
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    async def __call__(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            self.start_message = message
+            self.passthrough = not self._compressible(Headers(raw=message["headers"]))
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if message_type != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.stream is None and not more_body:
+            await self._send_whole(body)
+            return
+
+        if self.stream is None:
+            self.stream = _StreamCompressor(self.encoding, self.level)
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            del headers["Content-Length"]
+            await self.send(self.start_message)
+
+        if len(body) >= self.middleware.offload_size:
+            chunk = await run_in_threadpool(self.stream.push, body)
+        else:
+            chunk = self.stream.push(body)
+        if not more_body:
+            chunk += self.stream.finish()
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    async def _send_whole(self, body: bytes) -> None:
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        if len(body) < self.middleware.minimum_size:
+            await self.send(self.start_message)
+            await self.send({"type": "http.response.body", "body": body})
+            return
+
+        if len(body) >= self.middleware.offload_size:
+            compressed = await run_in_threadpool(compress, body, self.encoding, self.level)
+        else:
+            compressed = compress(body, self.encoding, self.level)
+
+        headers["Content-Encoding"] = self.encoding
+        headers["Content-Length"] = str(len(compressed))
+        headers.add_vary_header("Accept-Encoding")
+        await self.send(self.start_message)
+        await self.send({"type": "http.response.body", "body": compressed})
@@ -0,0 +1,337 @@
+"""Postgres storage backend: prepared SQL over asyncpg's binary protocol.
+
+Queries run on a connection pool (``PG_POOL_MIN_SIZE``/``PG_POOL_MAX_SIZE``).
+asyncpg prepares each distinct statement once per connection and caches it
+(``PG_STATEMENT_CACHE_SIZE``), so every statement here is fixed text with
+``$n`` parameters. Optional filters pick one of a few statement variants
+rather than inlining values. Use a direct or session-mode connection string:
+transaction-mode poolers (pgbouncer, Supavisor on port 6543) do not keep
+prepared statements.
+
+The pool's role bypasses row-level security, so every query carries the
+predicate the matching RLS policy would apply, e.g. ``supplier_id = $n`` on
+product writes and sender/recipient on message reads. The user ids come from
+the authenticated request, never from the request body.
+
+Rows are shaped like PostgREST output so endpoints do not care which backend
+answered:
+
+* uuid, numeric and timestamptz values decode straight to str, float and ISO
+  8601 strings, as ``to_json`` renders them;
+* embedded relations come back as nested dicts, or None when there is no
+  matching row.
+
+Calls honour the request deadline (see resilience.py), and identical reads in
+flight are coalesced.
+"""
+import asyncio
+import os
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional, Sequence, Set, Tuple
+
+import asyncpg
+from fastapi import HTTPException
+
+from resilience import DeadlineExceeded, coalesced, current_budget
+from storage import AUTHOR_COLUMNS, DETAIL_SUPPLIER_COLUMNS, LIST_SUPPLIER_COLUMNS, Storage
+
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "2"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+PG_STATEMENT_CACHE_SIZE = int(os.getenv("PG_STATEMENT_CACHE_SIZE", "256"))
+
+WRITABLE_TABLES = ("profiles", "products", "comments", "messages")
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _embed(alias: str, name: str, columns: Sequence[str]) -> str:
+    """Columns of a LEFT JOINed row, as ``name`` (present?) and ``name.column``."""
+    return ", ".join(
+        [f"{alias}.id IS NOT NULL AS {_ident(name)}"]
+        + [f"{alias}.{_ident(c)} AS {_ident(f'{name}.{c}')}" for c in columns]
+    )
+
+
+def _row(record: asyncpg.Record, embeds: Iterable[str] = ()) -> Dict[str, Any]:
+    row = dict(record)
+    for name in embeds:
+        prefix = name + "."
+        nested = {key[len(prefix):]: row.pop(key) for key in list(row) if key.startswith(prefix)}
+        row[name] = nested if row[name] else None
+    return row
+
+
+def _timestamp(text: str) -> str:
+    """``2024-05-01 10:00:00.25+00`` -> ``2024-05-01T10:00:00.25+00:00``, like to_json."""
+    date, _, time_ = text.partition(" ")
+    if time_[-3] in "+-":
+        time_ += ":00"
+    return f"{date}T{time_}"
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # Decode to the JSON-ready values PostgREST would send
+    await conn.set_type_codec("uuid", schema="pg_catalog", encoder=str, decoder=str, format="text")
+    await conn.set_type_codec("numeric", schema="pg_catalog", encoder=str, decoder=float, format="text")
+    await conn.set_type_codec("timestamptz", schema="pg_catalog", encoder=str, decoder=_timestamp, format="text")
+
+
+PRODUCT_FILTERS = (
+    ("category", "p.category = ${}"),
+    ("country", "p.supplier_country = ${}"),
+    ("city", "p.supplier_city = ${}"),
+    ("search", "p.name ILIKE ${}"),
+)
+
+PRODUCT_DETAIL_SQL = f"""
+    SELECT p.*, {_embed("s", "profiles", DETAIL_SUPPLIER_COLUMNS)}
+    FROM products p LEFT JOIN profiles s ON s.id = p.supplier_id
+    WHERE p.id = $1
+"""
+
+COMMENTS_SQL = f"""
+    SELECT c.*, {_embed("a", "profiles", AUTHOR_COLUMNS)}
+    FROM comments c LEFT JOIN profiles a ON a.id = c.user_id
+    WHERE c.product_id = $1
+    ORDER BY c.created_at DESC
+"""
+
+MESSAGES_SELECT = f"""
+    SELECT m.*, {_embed("s", "sender", AUTHOR_COLUMNS)}, {_embed("r", "recipient", AUTHOR_COLUMNS)}
+    FROM messages m
+    LEFT JOIN profiles s ON s.id = m.sender_id
+    LEFT JOIN profiles r ON r.id = m.recipient_id
+"""
+
+MESSAGES_SQL = MESSAGES_SELECT + """
+    WHERE m.sender_id = $1 OR m.recipient_id = $1
+    ORDER BY m.created_at DESC
+"""
+
+CONVERSATION_SQL = MESSAGES_SELECT + """
+    WHERE (m.sender_id = $1 AND m.recipient_id = $2) OR (m.sender_id = $2 AND m.recipient_id = $1)
+    ORDER BY m.created_at
+"""
+
+
+@lru_cache(maxsize=None)
+def _products_sql(filters: Tuple[str, ...]) -> str:
+    """Listing statement for one combination of filters (at most 16 variants)."""
+    conditions = [sql.format(i) for i, sql in enumerate(
+        (sql for name, sql in PRODUCT_FILTERS if name in filters), start=1
+    )]
+    n = len(conditions)
+    return f"""
+        SELECT p.*, {_embed("s", "profiles", LIST_SUPPLIER_COLUMNS)}
+        FROM products p LEFT JOIN profiles s ON s.id = p.supplier_id
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY p.created_at DESC
+        LIMIT ${n + 1} OFFSET ${n + 2}
+    """
+
+
+class PostgresStorage(Storage):
+    name = "postgres"
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.pool: Optional[asyncpg.Pool] = None
+        self.columns: Dict[str, Set[str]] = {}
+        self._connecting: Optional[asyncio.Task] = None
+
+    async def connect(self) -> None:
+        if self.pool is not None:
+            return
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._create_pool())
+        try:
+            await asyncio.shield(self._connecting)
+        except Exception:
+            self._connecting = None
+            raise
+
+    async def _create_pool(self) -> None:
+        pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=PG_POOL_MIN_SIZE,
+            max_size=PG_POOL_MAX_SIZE,
+            statement_cache_size=PG_STATEMENT_CACHE_SIZE,
+            server_settings={"TimeZone": "UTC", "DateStyle": "ISO"},
+            init=_init_connection,
+        )
+        rows = await pool.fetch(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE table_schema = 'public' AND table_name = ANY($1::text[])",
+            list(WRITABLE_TABLES),
+        )
+        for row in rows:
+            self.columns.setdefault(row["table_name"], set()).add(row["column_name"])
+        self.pool = pool
+
+    async def close(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            self._connecting = None
+
+    def stats(self) -> Dict[str, Any]:
+        if self.pool is None:
+            return {"backend": self.name, "connected": False}
+        return {
+            "backend": self.name,
+            "connected": True,
+            "pool_size": self.pool.get_size(),
+            "pool_idle": self.pool.get_idle_size(),
+            "pool_max": self.pool.get_max_size(),
+        }
+
+    # Execution -----------------------------------------------------------
+
+    @staticmethod
+    def _timeout() -> float:
+        remaining = current_budget().remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return remaining
+
+    async def _run(self, method: str, sql: str, *args) -> Any:
+        await self.connect()
+        try:
+            async with self.pool.acquire(timeout=self._timeout()) as conn:
+                return await getattr(conn, method)(sql, *args, timeout=self._timeout())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded()
+
+    async def _read(self, label: str, method: str, sql: str, *args) -> Any:
+        """Coalesced read; the result is shared with concurrent identical calls."""
+        return await coalesced(("pg", sql, args), lambda: self._run(method, sql, *args), label=label)
+
+    def _check_columns(self, table: str, columns: Iterable[str]) -> None:
+        # Same answer as PostgREST (and SupabaseStorage) for unknown columns,
+        # and keeps SQL text bounded
+        for column in columns:
+            if column not in self.columns.get(table, ()):
+                raise HTTPException(
+                    status_code=400, detail=f"Could not find the '{column}' column of '{table}' in the schema cache"
+                )
+
+    async def _insert(self, table: str, values: Dict[str, Any]) -> Dict[str, Any]:
+        await self.connect()
+        columns = sorted(values)
+        self._check_columns(table, columns)
+        sql = (
+            f"INSERT INTO {_ident(table)} ({', '.join(map(_ident, columns))}) "
+            f"VALUES ({', '.join(f'${i}' for i in range(1, len(columns) + 1))}) RETURNING *"
+        )
+        return dict(await self._run("fetchrow", sql, *[values[c] for c in columns]))
+
+    async def _update(self, table: str, fields: Dict[str, Any], where: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        await self.connect()
+        columns = sorted(fields)
+        self._check_columns(table, columns)
+        keys = list(where)
+        assignments = ", ".join(f"{_ident(c)} = ${i}" for i, c in enumerate(columns, start=1))
+        conditions = " AND ".join(f"{_ident(k)} = ${i}" for i, k in enumerate(keys, start=len(columns) + 1))
+        if assignments:
+            sql = f"UPDATE {_ident(table)} SET {assignments} WHERE {conditions} RETURNING *"
+        else:
+            sql = f"SELECT * FROM {_ident(table)} WHERE {conditions}"
+        record = await self._run("fetchrow", sql, *[fields[c] for c in columns], *[where[k] for k in keys])
+        return dict(record) if record is not None else None
+
+    # Profiles ------------------------------------------------------------
+
+    async def get_profile(self, user_id):
+        record = await self._read("profiles", "fetchrow", "SELECT * FROM profiles WHERE id = $1", user_id)
+        return dict(record) if record is not None else None
+
+    async def update_profile(self, user_id, fields):
+        return await self._update("profiles", fields, {"id": user_id})
+
+    # Products ------------------------------------------------------------
+
+    async def list_products(self, category=None, country=None, city=None, search=None, limit=20, offset=0):
+        values = {
+            "category": category,
+            "country": country,
+            "city": city,
+            # PostgREST also reads * as a wildcard in like patterns
+            "search": f"%{search}%".replace("*", "%") if search else None,
+        }
+        used = tuple(name for name, _ in PRODUCT_FILTERS if values[name])
+        records = await self._read(
+            "products", "fetch", _products_sql(used), *[values[name] for name in used], limit, offset
+        )
+        return [_row(r, ["profiles"]) for r in records]
+
+    async def get_product(self, product_id):
+        record = await self._read("products", "fetchrow", PRODUCT_DETAIL_SQL, product_id)
+        return _row(record, ["profiles"]) if record is not None else None
+
+    async def get_product_owner(self, product_id):
+        return await self._read("products", "fetchval", "SELECT supplier_id FROM products WHERE id = $1", product_id)
+
+    async def create_product(self, supplier_id, fields):
+        return await self._insert("products", {**fields, "supplier_id": supplier_id})
+
+    async def update_product(self, product_id, supplier_id, fields):
+        return await self._update("products", fields, {"id": product_id, "supplier_id": supplier_id})
+
+    async def delete_product(self, product_id, supplier_id):
+        deleted = await self._run(
+            "fetchval", "DELETE FROM products WHERE id = $1 AND supplier_id = $2 RETURNING id", product_id, supplier_id
+        )
+        return deleted is not None
+
+    # Comments and likes --------------------------------------------------
+
+    async def list_comments(self, product_id):
+        records = await self._read("comments", "fetch", COMMENTS_SQL, product_id)
+        return [_row(r, ["profiles"]) for r in records]
+
+    async def create_comment(self, user_id, fields):
+        return await self._insert("comments", {**fields, "user_id": user_id})
+
+    async def toggle_like(self, product_id, user_id):
+        # One transaction, and the count moves by one in SQL rather than read-modify-write
+        await self.connect()
+        try:
+            async with self.pool.acquire(timeout=self._timeout()) as conn, conn.transaction():
+                unliked = await conn.fetchval(
+                    "DELETE FROM product_likes WHERE product_id = $1 AND user_id = $2 RETURNING id",
+                    product_id, user_id, timeout=self._timeout(),
+                )
+                if unliked is not None:
+                    await conn.execute(
+                        "UPDATE products SET likes_count = greatest(likes_count - 1, 0) WHERE id = $1",
+                        product_id, timeout=self._timeout(),
+                    )
+                    return False
+                liked = await conn.fetchval(
+                    "INSERT INTO product_likes (product_id, user_id) VALUES ($1, $2) "
+                    "ON CONFLICT (product_id, user_id) DO NOTHING RETURNING id",
+                    product_id, user_id, timeout=self._timeout(),
+                )
+                if liked is not None:
+                    await conn.execute(
+                        "UPDATE products SET likes_count = likes_count + 1 WHERE id = $1",
+                        product_id, timeout=self._timeout(),
+                    )
+                return True
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded()
+
+    # Messages ------------------------------------------------------------
+
+    async def list_messages(self, user_id):
+        records = await self._read("messages", "fetch", MESSAGES_SQL, user_id)
+        return [_row(r, ["sender", "recipient"]) for r in records]
+
+    async def list_conversation(self, user_id, other_user_id):
+        records = await self._read("messages", "fetch", CONVERSATION_SQL, user_id, other_user_id)
+        return [_row(r, ["sender", "recipient"]) for r in records]
+
+    async def create_message(self, sender_id, fields):
+        return await self._insert("messages", {**fields, "sender_id": sender_id})
@@ -0,0 +1,257 @@
+"""Opt-in request profiling with pyinstrument.
+
+Profiling is off unless one of these is true:
+
+* ``PROFILE_SAMPLE_RATE`` is above zero. That fraction of requests is
+  profiled.
+* ``PROFILE_ROUTES`` lists path prefixes. Every request under them is
+  profiled.
+* A request carries ``X-Profile: <PROFILING_TOKEN>``.
+
+An admin with the token can change the rate and routes at runtime through
+``/api/admin/profiling``. With no rate or routes set, the middleware
+forwards each request after checking a single flag and, when
+``PROFILING_TOKEN`` is set, scanning the raw headers for ``X-Profile``.
+
+The profiler samples the request's async context (``async_mode="enabled"``).
+Time the request spends waiting is shown as ``[await]`` frames under the
+awaiting code, e.g. a Supabase call running in the threadpool. Python work on
+the event loop appears as ordinary frames, e.g. grouping loops or JSON
+encoding.
+
+Profiles are saved under ``PROFILE_DIR``. Only the most recent
+``PROFILE_KEEP`` are kept. Settings changes are written to the same
+directory and every worker polls them, so the whole server behaves the same
+way whichever worker answered the admin call. Profiles can be exported:
+
+* one request, as collapsed stacks (``flamegraph.pl``/speedscope input),
+  speedscope JSON or pyinstrument's HTML flame view;
+* or every profile of one route in a time window, merged.
+"""
+import hmac
+import json
+import os
+import random
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import HTMLRenderer, SpeedscopeRenderer
+    from pyinstrument.session import Session
+except ImportError:  # pragma: no cover - optional dependency
+    Profiler = None
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", Path(__file__).parent / "profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "500"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+
+EXPORT_FORMATS = ("collapsed", "speedscope", "html")
+
+
+def _frame_label(frame) -> Optional[str]:
+    if frame.file_path == "<thread>":
+        return None  # per-thread/task root: would keep identical stacks apart
+    if frame.is_synthetic or not frame.file_path_short:
+        return frame.function
+    return f"{frame.function} ({frame.file_path_short}:{frame.line_no})"
+
+
+def collapsed_stacks(session) -> str:
+    """``frame;frame;frame <microseconds>`` lines, one per distinct stack."""
+    totals: Dict[str, int] = {}
+
+    def walk(frame, stack: str) -> None:
+        label = _frame_label(frame)
+        if label is not None:
+            label = label.replace(";", ":")
+            stack = f"{stack};{label}" if stack else label
+        # Exclusive time; pyinstrument's own self time also counts [await] children
+        exclusive = frame.time - sum(child.time for child in frame.children)
+        if exclusive > 0 and stack:
+            totals[stack] = totals.get(stack, 0) + int(exclusive * 1_000_000)
+        for child in frame.children:
+            walk(child, stack)
+
+    root = session.root_frame()
+    if root is not None:
+        walk(root, "")
+    return "".join(f"{stack} {micros}\n" for stack, micros in totals.items() if micros > 0)
+
+
+def render(session, fmt: str) -> str:
+    if fmt == "collapsed":
+        return collapsed_stacks(session)
+    if fmt == "speedscope":
+        return SpeedscopeRenderer().render(session)
+    return HTMLRenderer().render(session)
+
+
+class RequestProfiler:
+    def __init__(self, directory: Path = PROFILE_DIR):
+        self.directory = Path(directory)
+        self.available = Profiler is not None
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        self.routes = [r for r in os.getenv("PROFILE_ROUTES", "").split(",") if r]
+        self._settings_mtime: Optional[int] = None
+        self._update_armed()
+
+    # Settings ------------------------------------------------------------
+
+    def _update_armed(self) -> None:
+        # The X-Profile header is checked separately (see requested)
+        self.armed = self.available and bool(self.sample_rate > 0 or self.routes)
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            "available": self.available,
+            "sample_rate": self.sample_rate,
+            "routes": self.routes,
+            "interval": PROFILE_INTERVAL,
+            "keep": PROFILE_KEEP,
+        }
+
+    def configure(self, sample_rate: Optional[float] = None, routes: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Change the settings here and, through the settings file, in every worker."""
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if routes is not None:
+            self.routes = routes
+        self._update_armed()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.directory / f"settings.json.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps({"sample_rate": self.sample_rate, "routes": self.routes}))
+        os.replace(tmp, self.directory / "settings.json")
+        return self.settings()
+
+    def reload_settings(self) -> None:
+        path = self.directory / "settings.json"
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._settings_mtime:
+            self._settings_mtime = mtime
+            saved = json.loads(path.read_text())
+            self.sample_rate, self.routes = saved["sample_rate"], saved["routes"]
+            self._update_armed()
+
+    @staticmethod
+    def is_admin(token: Optional[str]) -> bool:
+        return bool(PROFILING_TOKEN) and token is not None and hmac.compare_digest(token, PROFILING_TOKEN)
+
+    def requested(self, scope: Scope) -> bool:
+        """Whether the request carries ``X-Profile: <PROFILING_TOKEN>``."""
+        if not (self.available and PROFILING_TOKEN):
+            return False
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return self.is_admin(value.decode("latin-1"))
+        return False
+
+    def wants(self, scope: Scope) -> bool:
+        """Whether the configured routes or sample rate select the request."""
+        if any(scope["path"].startswith(prefix) for prefix in self.routes):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    # Storage -------------------------------------------------------------
+
+    def save(self, profile_id: str, meta: Dict[str, Any], session) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{int(meta['started_at'] * 1000)}-{profile_id}.json"
+        tmp = self.directory / (name + ".tmp")
+        tmp.write_text(json.dumps({"meta": meta, "session": session.to_json()}))
+        os.replace(tmp, self.directory / name)
+        for stale in self._files()[:-PROFILE_KEEP]:
+            stale.unlink(missing_ok=True)
+
+    def _files(self) -> List[Path]:
+        if not self.directory.exists():
+            return []
+        return sorted(p for p in self.directory.glob("*.json") if p.name != "settings.json")
+
+    def _load(self, path: Path) -> Dict[str, Any]:
+        return json.loads(path.read_text())
+
+    def profiles(self, route: Optional[str] = None, since: float = 0) -> Iterator[Dict[str, Any]]:
+        """Saved profiles, newest first, as dicts with ``meta`` and ``session``."""
+        for path in reversed(self._files()):
+            if int(path.name.split("-", 1)[0]) / 1000 < since:
+                break
+            try:
+                record = self._load(path)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue  # pruned or being written by another worker
+            if route is None or record["meta"]["route"] == route:
+                yield record
+
+    def get(self, profile_id: str):
+        """The saved session for ``profile_id``, or None."""
+        if not profile_id.isalnum():
+            return None
+        for path in self.directory.glob(f"*-{profile_id}.json"):
+            return Session.from_json(self._load(path)["session"])
+        return None
+
+    def aggregate(self, route: str, window: float):
+        """Merge every profile of ``route`` from the last ``window`` seconds."""
+        merged = None
+        for record in self.profiles(route, since=time.time() - window):
+            session = Session.from_json(record["session"])
+            merged = session if merged is None else Session.combine(merged, session)
+        return merged
+
+
+request_profiler = RequestProfiler()
+
+
+class ProfilingMiddleware:
+    """Profile selected requests; mark them with an ``X-Profile-Id`` header."""
+
+    def __init__(self, app: ASGIApp, profiler: RequestProfiler = request_profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not (
+            (self.profiler.armed and self.profiler.wants(scope)) or self.profiler.requested(scope)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:16]
+        status = {"code": None}
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                MutableHeaders(raw=message["headers"])["X-Profile-Id"] = profile_id
+            await send(message)
+
+        started_at = time.time()
+        profiler = Profiler(interval=PROFILE_INTERVAL, async_mode="enabled")
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            session = profiler.stop()
+            route = scope.get("route")
+            meta = {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": getattr(route, "path", scope["path"]),
+                "status": status["code"],
+                "started_at": started_at,
+                "duration_ms": round(session.duration * 1000, 2),
+                "samples": session.sample_count,
+            }
+            await run_in_threadpool(self.profiler.save, profile_id, meta, session)
@@ -0,0 +1,398 @@
+"""Resilience layer for upstream (Supabase) calls.
+
+Every call runs in the threadpool under the request's deadline and a circuit
+breaker keyed by ``(table, operation)``:
+
+* ``DeadlineMiddleware`` gives each request a time budget
+  (``REQUEST_DEADLINE_MS``; clients may ask for less with the
+  ``X-Request-Deadline-Ms`` header). Upstream calls never wait past it and
+  fail with 504 once it is spent.
+* Idempotent reads are retried with full-jitter exponential backoff, and when
+  an attempt is slower than the recent p95 for its key a second, hedged
+  attempt is sent and the first answer wins.
+* After ``BREAKER_FAILURE_THRESHOLD`` consecutive failures a breaker opens for
+  ``BREAKER_RESET_SECONDS``; while it is open, reads are answered from the
+  last good response for the same query when there is one (the response is
+  marked with ``X-Served-Stale: 1``) and everything else fails fast with 503.
+
+Failures are transport errors, attempts that run out their
+``UPSTREAM_ATTEMPT_TIMEOUT``, and PostgREST errors that mean Supabase itself
+is unwell: gateway 5xx, ``PGRST000``-``PGRST003`` (database unreachable or
+pool exhausted) and statement timeouts (``57014``). A request whose own
+budget ends first (e.g. a client asking for a 5 ms deadline) gets a 504
+without counting against the breaker, so no client can open it for everyone.
+Other PostgREST errors (4xx, bad filters, constraint violations) are answers,
+and are raised as-is.
+
+Identical reads in flight are coalesced (see singleflight.py). The shared call
+runs under a default budget of its own and each caller waits for it within
+its own deadline, so a caller with a short deadline fails alone.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+from postgrest.exceptions import APIError
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from singleflight import query_key, single_flight
+
+REQUEST_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", "8000"))
+ATTEMPT_TIMEOUT = float(os.getenv("UPSTREAM_ATTEMPT_TIMEOUT", "3"))
+READ_ATTEMPTS = int(os.getenv("UPSTREAM_READ_ATTEMPTS", "3"))
+BACKOFF_BASE = 0.05
+BACKOFF_CAP = 1.0
+HEDGING = os.getenv("UPSTREAM_HEDGING", "1") == "1"
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.02
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "10"))
+STALE_CACHE_SIZE = int(os.getenv("STALE_CACHE_SIZE", "256"))
+STALE_MAX_AGE = float(os.getenv("STALE_MAX_AGE", "300"))
+
+RETRYABLE = (httpx.TransportError, asyncio.TimeoutError)
+# PostgREST: database unreachable, pool exhausted/timed out, schema cache not
+# loaded; Postgres: statement timeout
+UNAVAILABLE_CODES = {"PGRST000", "PGRST001", "PGRST002", "PGRST003", "57014"}
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Whether ``error`` says upstream is unwell rather than answering the query."""
+    if isinstance(error, RETRYABLE):
+        return True
+    if isinstance(error, APIError):
+        # Gateway errors carry the HTTP status as the code (an int, or a string)
+        code = str(error.code or "")
+        return code in UNAVAILABLE_CODES or (code.isdigit() and 500 <= int(code) < 600)
+    return False
+
+
+class UpstreamUnavailable(HTTPException):
+    def __init__(self, key: str):
+        super().__init__(
+            status_code=503,
+            detail=f"Upstream {key} is unavailable, try again shortly",
+            headers={"Retry-After": str(int(BREAKER_RESET_SECONDS))},
+        )
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=504, detail="Upstream did not answer within the request deadline")
+
+
+class RequestBudget:
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.served_stale = False
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+
+_budget: contextvars.ContextVar[Optional[RequestBudget]] = contextvars.ContextVar("request_budget", default=None)
+
+
+def current_budget() -> RequestBudget:
+    budget = _budget.get()
+    if budget is None:
+        # Calls outside a request (warm-up, scripts) get a fresh default budget
+        budget = RequestBudget(time.monotonic() + REQUEST_DEADLINE_MS / 1000)
+    return budget
+
+
+class DeadlineMiddleware:
+    """Attach a RequestBudget to each HTTP request's context."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget_ms = REQUEST_DEADLINE_MS
+        requested = Headers(scope=scope).get("x-request-deadline-ms")
+        if requested and requested.isdigit():
+            budget_ms = min(budget_ms, int(requested))
+        budget = RequestBudget(time.monotonic() + budget_ms / 1000)
+        token = _budget.set(budget)
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start" and budget.served_stale:
+                MutableHeaders(raw=message["headers"])["X-Served-Stale"] = "1"
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _budget.reset(token)
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe."""
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= BREAKER_RESET_SECONDS:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= BREAKER_FAILURE_THRESHOLD:
+            if self.opened_at is None:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+
+
+class LatencyWindow:
+    """Recent latencies for one key, for the hedging p95."""
+
+    def __init__(self, size: int = 200):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+
+class StaleCache:
+    """Bounded LRU of the last good response per query."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > STALE_MAX_AGE:
+            return None
+        return entry[1]
+
+
+class Upstream:
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latencies: Dict[str, LatencyWindow] = {}
+        self.stale = StaleCache(STALE_CACHE_SIZE)
+        self.counters: Dict[str, int] = {"retries": 0, "hedges": 0, "hedge_wins": 0, "stale_served": 0, "rejected": 0}
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker()
+        return self.breakers[key]
+
+    async def _attempt(self, key: str, fn: Callable[[], Any], timeout: float) -> Any:
+        start = time.monotonic()
+        result = await asyncio.wait_for(run_in_threadpool(fn), timeout=timeout)
+        self.latencies.setdefault(key, LatencyWindow()).add(time.monotonic() - start)
+        return result
+
+    async def _hedged_attempt(self, key: str, fn: Callable[[], Any], timeout: float) -> Any:
+        window = self.latencies.get(key)
+        p95 = window.p95() if window else None
+        if not HEDGING or p95 is None or max(p95, HEDGE_MIN_DELAY) >= timeout:
+            return await self._attempt(key, fn, timeout)
+
+        start = time.monotonic()
+        first = asyncio.ensure_future(self._attempt(key, fn, timeout))
+        done, _ = await asyncio.wait({first}, timeout=max(p95, HEDGE_MIN_DELAY))
+        if done:
+            return first.result()
+
+        self.counters["hedges"] += 1
+        second = asyncio.ensure_future(self._attempt(key, fn, timeout - (time.monotonic() - start)))
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if task is second:
+                        self.counters["hedge_wins"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def call(self, fn: Callable[[], Any], key: str, idempotent: bool, cache_key: Optional[Hashable] = None) -> Any:
+        """Run the blocking ``fn`` under deadline, breaker and (for reads) retry/hedging."""
+        budget = current_budget()
+        breaker = self.breaker(key)
+
+        if not breaker.allow():
+            return self._fallback(key, cache_key, budget, UpstreamUnavailable(key))
+
+        attempts = READ_ATTEMPTS if idempotent else 1
+        last_error: Optional[BaseException] = None
+        for attempt in range(attempts):
+            remaining = budget.remaining()
+            if remaining <= 0:
+                last_error = DeadlineExceeded()
+                break
+            timeout = min(remaining, ATTEMPT_TIMEOUT) if idempotent else remaining
+            try:
+                if idempotent:
+                    result = await self._hedged_attempt(key, fn, timeout)
+                else:
+                    result = await self._attempt(key, fn, timeout)
+            except Exception as e:
+                if not is_upstream_failure(e):
+                    # An answer from upstream (e.g. a 4xx PostgREST error): it is up
+                    breaker.record_success()
+                    raise
+                if isinstance(e, asyncio.TimeoutError) and timeout < ATTEMPT_TIMEOUT:
+                    # The request's budget ended the attempt, not upstream's
+                    # slowness: no verdict, and a half-open probe slot is freed
+                    breaker.probing = False
+                    last_error = DeadlineExceeded()
+                    break
+                last_error = DeadlineExceeded() if isinstance(e, asyncio.TimeoutError) else e
+                breaker.record_failure()
+                if attempt + 1 == attempts or not breaker.allow():
+                    break
+                self.counters["retries"] += 1
+                backoff = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                await asyncio.sleep(min(backoff, max(budget.remaining(), 0)))
+                continue
+            except BaseException:
+                # Cancelled: release a half-open probe slot without a verdict
+                breaker.probing = False
+                raise
+            breaker.record_success()
+            if cache_key is not None:
+                self.stale.put(cache_key, result)
+            return result
+
+        return self._fallback(key, cache_key, budget, last_error)
+
+    def _fallback(self, key: str, cache_key: Optional[Hashable], budget: RequestBudget, error: BaseException) -> Any:
+        cached = self.stale.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            self.counters["stale_served"] += 1
+            budget.served_stale = True
+            return cached
+        if isinstance(error, UpstreamUnavailable):
+            self.counters["rejected"] += 1
+        if isinstance(error, HTTPException):
+            raise error
+        raise UpstreamUnavailable(key) from error
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "breakers": {
+                key: {"state": b.state, "failures": b.failures, "times_opened": b.times_opened}
+                for key, b in self.breakers.items()
+            },
+            "p95_ms": {
+                key: round(p95 * 1000, 1)
+                for key, window in self.latencies.items()
+                if (p95 := window.p95()) is not None
+            },
+        }
+
+
+upstream = Upstream()
+
+
+def _operation_key(query) -> str:
+    return f"{query.path.lstrip('/')}:{query.http_method.lower()}"
+
+
+async def coalesced(key: Hashable, fn: Callable[[], Awaitable[Any]], label: str = "") -> Any:
+    """Await ``fn()`` shared with concurrent callers of ``key``, within the caller's deadline.
+
+    The shared call gets a fresh default budget rather than the first caller's,
+    and a stale answer is flagged on every caller's response.
+    """
+    budget = current_budget()
+    remaining = budget.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+
+    async def shared() -> Tuple[Any, bool]:
+        # Runs in its own task (and context), owned by no caller
+        shared_budget = RequestBudget(time.monotonic() + REQUEST_DEADLINE_MS / 1000)
+        _budget.set(shared_budget)
+        return await fn(), shared_budget.served_stale
+
+    try:
+        result, stale = await asyncio.wait_for(single_flight.do(key, shared, label=label), timeout=remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
+    if stale:
+        budget.served_stale = True
+    return result
+
+
+async def execute_read(query, fresh: bool = False) -> Any:
+    """Idempotent read: coalesced, retried, hedged, breaker-guarded, stale-cached.
+
+    ``fresh=True`` is for reads that must observe writes made earlier in the
+    same request (read-modify-write): they are neither coalesced nor ever
+    answered from the stale cache.
+    """
+    if fresh:
+        return await upstream.call(query.execute, _operation_key(query), idempotent=True)
+    key = query_key(query)
+    return await coalesced(
+        key,
+        lambda: upstream.call(query.execute, _operation_key(query), idempotent=True, cache_key=key),
+        label=query.path.lstrip("/"),
+    )
+
+
+async def execute(query) -> Any:
+    """Write (or any non-idempotent call): deadline and breaker only, never retried."""
+    return await upstream.call(query.execute, _operation_key(query), idempotent=False)
+
+
+async def call_upstream(fn: Callable[[], Any], key: str, idempotent: bool = False) -> Any:
+    """Guard a non-query upstream call, e.g. ``supabase.auth.get_user``."""
+    return await upstream.call(fn, key, idempotent=idempotent)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Production launcher: N preloaded uvicorn workers under gunicorn.
+
+The app is imported once in the master (``preload_app``) so forked workers
+skip module import and become ready quickly; each worker then warms up in
+its own startup handler (Supabase client, static responses, upstream check,
+storage backend connection) and reports it through ``/api/health/ready``. On
+SIGTERM workers stop accepting connections and drain in-flight requests for
+up to ``--graceful-timeout`` seconds.
+
+    python serve.py [--workers N] [--bind 0.0.0.0:8001]
+
+Use ``python server.py`` for single-process development.
+"""
+import argparse
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+class TradHubApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        from server import app
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the TradHub API with multiple workers")
+    parser.add_argument("--bind", default=os.getenv("BIND", "0.0.0.0:8001"))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count())))
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")))
+    parser.add_argument("--keepalive", type=int, default=5)
+    args = parser.parse_args()
+
+    TradHubApplication({
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True,
+        "graceful_timeout": args.graceful_timeout,
+        "timeout": args.graceful_timeout + 30,
+        "keepalive": args.keepalive,
+        "accesslog": "-",
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,39 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, status
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+from itertools import islice
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
+from analytics import analytics_store, create_reader
+from compression import CompressionMiddleware
+from profiling import EXPORT_FORMATS, ProfilingMiddleware, render, request_profiler
+from recommendations import INDEX_COLUMNS, similarity_index
+from resilience import DeadlineMiddleware, call_upstream, execute, execute_read, upstream
+from singleflight import single_flight
+from storage import create_storage
+from uploads import ALLOWED_IMAGE_TYPES, is_multipart, parse_product_multipart, remove_product_image, store_product_image
 import os
+import asyncio
 import logging
+import signal
+import threading
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Awaitable, Callable
 import uuid
-from datetime import datetime
+import base64
+from datetime import datetime, timedelta, timezone
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # Supabase connection
-def get_supabase() -> Client:
+def create_supabase(key: Optional[str] = None) -> Client:
     url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_KEY")
+    key = key or os.getenv("SUPABASE_KEY")
     if not url or not key:
         raise Exception("Supabase credentials not found")
     try:
@@ -31,6 +47,36 @@ def get_supabase() -> Client:
             return create_client(url, key)
         raise e
 
+_supabase_client: Optional[Client] = None
+
+def get_supabase() -> Client:
+    """Shared client for data access, built once per worker.
+
+    Auth flows that store a session on the client (sign in/up/out) must use
+    create_supabase() so one user's session never leaks into another request.
+    """
+    global _supabase_client
+    if _supabase_client is None:
+        _supabase_client = create_supabase()
+    return _supabase_client
+
+_service_client: Optional[Client] = None
+
+def get_service_supabase() -> Client:
+    """Shared client with the service role key, for calls the public roles
+    may not make (place_order, product image uploads).
+
+    Falls back to SUPABASE_KEY when SUPABASE_SERVICE_KEY is not set, for
+    deployments where that key already is the service role key.
+    """
+    global _service_client
+    if _service_client is None:
+        _service_client = create_supabase(os.getenv("SUPABASE_SERVICE_KEY"))
+    return _service_client
+
+# Profiles, products, comments, likes and messages (see storage.py)
+storage = create_storage(get_supabase)
+
 # Create the main app
 app = FastAPI(title="TradHub API", version="1.0.0")
 
@@ -79,17 +125,26 @@ class CommentCreate(BaseModel):
     product_id: str
     content: str
 
+class OrderItem(BaseModel):
+    product_id: str
+    quantity: int = Field(1, gt=0, le=1000)
+
+class OrderCreate(BaseModel):
+    items: List[OrderItem] = Field(..., min_length=1, max_length=50)
+
 # Helper function to get current user
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         supabase = get_supabase()
-        user = supabase.auth.get_user(credentials.credentials)
+        user = await call_upstream(lambda: supabase.auth.get_user(credentials.credentials), "auth:get_user", idempotent=True)
         if not user or not user.user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid authentication credentials"
             )
         return user.user
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -100,10 +155,10 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 @api_router.post("/auth/signup")
 async def signup(user_data: UserCreate):
     try:
-        supabase = get_supabase()
+        supabase = create_supabase()
         
         # Create user in Supabase Auth
-        response = supabase.auth.sign_up({
+        response = await call_upstream(lambda: supabase.auth.sign_up({
             "email": user_data.email,
             "password": user_data.password,
             "options": {
@@ -116,7 +171,7 @@ async def signup(user_data: UserCreate):
                     "user_type": user_data.user_type
                 }
             }
-        })
+        }), "auth:sign_up")
         
         if response.user:
             # Create profile in our custom table - using existing column names
@@ -133,31 +188,32 @@ async def signup(user_data: UserCreate):
                 "avatar_url": None  # Use existing avatar_url column
             }
             
-            supabase.table("profiles").insert(profile_data).execute()
+            await execute(supabase.table("profiles").insert(profile_data))
         
         return {
             "message": "User created successfully", 
             "user": response.user,
             "requires_verification": True
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @api_router.post("/auth/signin")
 async def signin(login_data: UserLogin):
     try:
-        supabase = get_supabase()
+        supabase = create_supabase()
         
         # Try to sign in with email first
-        response = supabase.auth.sign_in_with_password({
+        response = await call_upstream(lambda: supabase.auth.sign_in_with_password({
             "email": login_data.identifier,
             "password": login_data.password
-        })
+        }), "auth:sign_in")
         
         if response.session:
             # Get user profile
-            profile_response = supabase.table("profiles").select("*").eq("id", response.user.id).execute()
-            profile = profile_response.data[0] if profile_response.data else None
+            profile = await storage.get_profile(response.user.id)
             
             return {
                 "access_token": response.session.access_token,
@@ -166,15 +222,19 @@ async def signin(login_data: UserLogin):
                 "profile": profile
             }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid credentials")
 
 @api_router.post("/auth/signout")
 async def signout(current_user=Depends(get_current_user)):
     try:
-        supabase = get_supabase()
-        supabase.auth.sign_out()
+        supabase = create_supabase()
+        await call_upstream(supabase.auth.sign_out, "auth:sign_out")
         return {"message": "Signed out successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -182,21 +242,23 @@ async def signout(current_user=Depends(get_current_user)):
 @api_router.get("/profile")
 async def get_profile(current_user=Depends(get_current_user)):
     try:
-        supabase = get_supabase()
-        response = supabase.table("profiles").select("*").eq("id", current_user.id).execute()
-        if response.data:
-            return response.data[0]
+        profile = await storage.get_profile(current_user.id)
+        if profile:
+            return profile
         return {"id": current_user.id, "email": current_user.email}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.put("/profile")
 async def update_profile(profile_data: dict, current_user=Depends(get_current_user)):
     try:
-        supabase = get_supabase()
         update_data = {k: v for k, v in profile_data.items() if v is not None}
-        response = supabase.table("profiles").update(update_data).eq("id", current_user.id).execute()
-        return response.data[0] if response.data else {"message": "Profile updated"}
+        profile = await storage.update_profile(current_user.id, update_data)
+        return profile or {"message": "Profile updated"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -211,139 +273,235 @@ async def get_products(
     offset: int = 0
 ):
     try:
-        supabase = get_supabase()
-        query = supabase.table("products").select("""
-            *,
-            profiles:supplier_id (username, first_name, last_name, country, city, avatar_url)
-        """)
-        
-        if category:
-            query = query.eq("category", category)
-        if country:
-            query = query.eq("supplier_country", country)
-        if city:
-            query = query.eq("supplier_city", city)
-        if search:
-            query = query.ilike("name", f"%{search}%")
-            
-        response = query.range(offset, offset + limit - 1).order("created_at", desc=True).execute()
-        return {"products": response.data, "count": len(response.data)}
+        products = await storage.list_products(category, country, city, search, limit, offset)
+        return {"products": products, "count": len(products)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/products/{product_id}")
 async def get_product(product_id: str):
     try:
-        supabase = get_supabase()
-        response = supabase.table("products").select("""
-            *,
-            profiles:supplier_id (full_name, country, city, avatar_base64)
-        """).eq("id", product_id).execute()
-        
-        if not response.data:
+        product = await storage.get_product(product_id)
+        if not product:
             raise HTTPException(status_code=404, detail="Product not found")
         
         # Get comments for this product
-        comments_response = supabase.table("comments").select("""
-            *,
-            profiles:user_id (full_name, avatar_base64)
-        """).eq("product_id", product_id).order("created_at", desc=True).execute()
+        comments = await storage.list_comments(product_id)
         
-        product = response.data[0]
-        product["comments"] = comments_response.data
-        
-        return product
+        # Rows may be shared with coalesced requests: copy before adding fields
+        return {**product, "comments": comments}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/products")
-async def create_product(product: ProductCreate, current_user=Depends(get_current_user)):
+def product_body_doc(model) -> Dict[str, Any]:
+    """OpenAPI request body for endpoints reading a product via read_product_payload."""
+    return {"requestBody": {"required": True, "content": {
+        "application/json": {"schema": model.model_json_schema()},
+        "multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {
+                "product": {"type": "string", "description": f"JSON-encoded {model.__name__} fields"},
+                "image": {"type": "string", "format": "binary", "description": ", ".join(ALLOWED_IMAGE_TYPES)},
+            },
+            "required": ["product"],
+        }},
+    }}}
+
+async def read_product_payload(request: Request, model):
+    """Parse a JSON or multipart product body into (model instance, optional ImageUpload)."""
+    image = None
     try:
-        supabase = get_supabase()
-        
-        # Check if user is a verified supplier
-        profile_response = supabase.table("profiles").select("user_type, is_supplier_verified").eq("id", current_user.id).execute()
-        profile = profile_response.data[0] if profile_response.data else None
+        if is_multipart(request):
+            fields, image = await parse_product_multipart(request)
+        else:
+            try:
+                fields = await request.json()
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Request body must be valid JSON")
+            if not isinstance(fields, dict):
+                raise HTTPException(status_code=400, detail="Request body must be a JSON object")
+        return model(**fields), image
+    except ValidationError as e:
+        if image is not None:
+            image.close()
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+
+async def discard_product_image(image_url: Optional[str]):
+    """Delete an uploaded image no product refers to; a failure only leaves an orphan behind."""
+    try:
+        await remove_product_image(get_service_supabase(), image_url)
+    except Exception as e:
+        logger.warning("Could not delete product image %s: %s", image_url, e)
+
+@api_router.post("/products", openapi_extra=product_body_doc(ProductCreate))
+async def create_product(request: Request, current_user=Depends(get_current_user)):
+    image = None
+    try:
+        # Check if user is a supplier; the profile also gives the product's location
+        profile = await storage.get_profile(current_user.id)
         
         if not profile or profile["user_type"] != "supplier":
             raise HTTPException(status_code=403, detail="Only suppliers can create products")
         
-        # Get supplier location for product
-        supplier_profile = supabase.table("profiles").select("country, city").eq("id", current_user.id).execute()
-        supplier_location = supplier_profile.data[0] if supplier_profile.data else {}
+        # Only read the (possibly large) body once the caller is known to be a supplier
+        product, image = await read_product_payload(request, ProductCreate)
         
         product_data = {
             **product.dict(),
             "id": str(uuid.uuid4()),
-            "supplier_id": current_user.id,
-            "supplier_country": supplier_location.get("country"),
-            "supplier_city": supplier_location.get("city"),
+            "supplier_country": profile.get("country"),
+            "supplier_city": profile.get("city"),
             "likes_count": 0,
             "created_at": datetime.utcnow().isoformat()
         }
+        if image is not None:
+            product_data["image_url"] = await store_product_image(get_service_supabase(), current_user.id, product_data["id"], image)
         
-        response = supabase.table("products").insert(product_data).execute()
-        return response.data[0]
+        try:
+            created = await storage.create_product(current_user.id, product_data)
+        except Exception:
+            # No product refers to the uploaded image
+            await discard_product_image(product_data.get("image_url"))
+            raise
+        similarity_index.upsert(created)
+        return created
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if image is not None:
+            image.close()
 
-@api_router.put("/products/{product_id}")
-async def update_product(product_id: str, product: ProductUpdate, current_user=Depends(get_current_user)):
+@api_router.put("/products/{product_id}", openapi_extra=product_body_doc(ProductUpdate))
+async def update_product(product_id: str, request: Request, current_user=Depends(get_current_user)):
+    image = None
     try:
-        supabase = get_supabase()
-        
-        # Check if user owns the product
-        existing = supabase.table("products").select("supplier_id").eq("id", product_id).execute()
-        if not existing.data or existing.data[0]["supplier_id"] != current_user.id:
+        # Check if user owns the product before reading the body
+        if await storage.get_product_owner(product_id) != current_user.id:
             raise HTTPException(status_code=403, detail="Not authorized to update this product")
         
+        product, image = await read_product_payload(request, ProductUpdate)
         update_data = {k: v for k, v in product.dict().items() if v is not None}
-        response = supabase.table("products").update(update_data).eq("id", product_id).execute()
-        return response.data[0]
+        replaced_image_url = None
+        if image is not None:
+            replaced_image_url = ((await storage.get_product(product_id)) or {}).get("image_url")
+            # A stored image replaces any inline base64 one
+            update_data["image_url"] = await store_product_image(get_service_supabase(), current_user.id, product_id, image)
+            update_data["image_base64"] = None
+        try:
+            updated = await storage.update_product(product_id, current_user.id, update_data)
+        except Exception:
+            await discard_product_image(update_data.get("image_url"))
+            raise
+        if updated is None:
+            await discard_product_image(update_data.get("image_url"))
+            raise HTTPException(status_code=404, detail="Product not found")
+        # The replaced image is no longer referenced
+        await discard_product_image(replaced_image_url)
+        similarity_index.upsert(updated)
+        return updated
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if image is not None:
+            image.close()
 
 @api_router.delete("/products/{product_id}")
 async def delete_product(product_id: str, current_user=Depends(get_current_user)):
     try:
-        supabase = get_supabase()
-        
-        # Check if user owns the product
-        existing = supabase.table("products").select("supplier_id").eq("id", product_id).execute()
-        if not existing.data or existing.data[0]["supplier_id"] != current_user.id:
+        # Deletes only a product the user owns
+        if not await storage.delete_product(product_id, current_user.id):
             raise HTTPException(status_code=403, detail="Not authorized to delete this product")
         
-        supabase.table("products").delete().eq("id", product_id).execute()
+        similarity_index.remove(product_id)
         return {"message": "Product deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Like/Unlike Product
-@api_router.post("/products/{product_id}/like")
-async def toggle_like(product_id: str, current_user=Depends(get_current_user)):
+# Similar products (see recommendations.py)
+SIMILAR_PRODUCT_COLUMNS = (
+    "id, name, price, category, image_url, image_base64, likes_count, supplier_id, supplier_country, supplier_city"
+)
+RECOMMENDER_REFRESH_SECONDS = int(os.getenv("RECOMMENDER_REFRESH_SECONDS", "600"))
+
+async def load_catalog(page_size: int = 1000) -> List[Dict[str, Any]]:
+    supabase = get_supabase()
+    rows: List[Dict[str, Any]] = []
+    while True:
+        # Keyset paging: each page is an index range scan, however deep
+        query = supabase.table("products").select(INDEX_COLUMNS)
+        if rows:
+            query = query.gt("id", rows[-1]["id"])
+        page = await execute_read(query.order("id").limit(page_size), fresh=True)
+        rows.extend(page.data)
+        if len(page.data) < page_size:
+            return rows
+
+async def refresh_similarity_index():
+    """Rebuild (and so compact) the similarity index from the catalog periodically."""
+    while True:
+        try:
+            # Writes from here on are replayed onto the rebuilt index
+            similarity_index.begin_rebuild()
+            products = await load_catalog()
+            await run_in_threadpool(similarity_index.rebuild, products)
+            logger.info("Similarity index rebuilt with %d products", len(products))
+        except Exception as e:
+            logger.warning("Similarity index rebuild failed: %s", e)
+        await asyncio.sleep(RECOMMENDER_REFRESH_SECONDS if similarity_index.ready else 30)
+
+@api_router.get("/products/{product_id}/similar")
+async def get_similar_products(product_id: str, limit: int = Query(10, ge=1, le=50)):
     try:
         supabase = get_supabase()
+        scored = similarity_index.similar(product_id, limit) if similarity_index.ready else []
         
-        # Check if already liked
-        existing_like = supabase.table("product_likes").select("*").eq("product_id", product_id).eq("user_id", current_user.id).execute()
+        if not scored:
+            # Index still loading or product not indexed yet: fall back to its category
+            product = await execute_read(supabase.table("products").select("category").eq("id", product_id))
+            if not product.data:
+                raise HTTPException(status_code=404, detail="Product not found")
+            response = await execute_read(
+                supabase.table("products").select(SIMILAR_PRODUCT_COLUMNS)
+                .eq("category", product.data[0]["category"]).neq("id", product_id)
+                .order("likes_count", desc=True).limit(limit)
+            )
+            return {"products": response.data, "count": len(response.data), "source": "category"}
         
-        if existing_like.data:
-            # Unlike
-            supabase.table("product_likes").delete().eq("product_id", product_id).eq("user_id", current_user.id).execute()
-            # Decrease like count
-            product = supabase.table("products").select("likes_count").eq("id", product_id).execute()
-            new_count = max(0, product.data[0]["likes_count"] - 1)
-            supabase.table("products").update({"likes_count": new_count}).eq("id", product_id).execute()
-            return {"message": "Product unliked", "liked": False}
-        else:
-            # Like
-            supabase.table("product_likes").insert({"product_id": product_id, "user_id": current_user.id}).execute()
-            # Increase like count
-            product = supabase.table("products").select("likes_count").eq("id", product_id).execute()
-            new_count = product.data[0]["likes_count"] + 1
-            supabase.table("products").update({"likes_count": new_count}).eq("id", product_id).execute()
+        scores = dict(scored)
+        response = await execute_read(
+            supabase.table("products").select(SIMILAR_PRODUCT_COLUMNS).in_("id", list(scores))
+        )
+        products = sorted(
+            ({**row, "score": round(scores[row["id"]], 4)} for row in response.data),
+            key=lambda row: row["score"],
+            reverse=True
+        )
+        return {"products": products, "count": len(products), "source": "index"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Like/Unlike Product
+@api_router.post("/products/{product_id}/like")
+async def toggle_like(product_id: str, current_user=Depends(get_current_user)):
+    try:
+        if await storage.toggle_like(product_id, current_user.id):
             return {"message": "Product liked", "liked": True}
-            
+        return {"message": "Product unliked", "liked": False}
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -351,15 +509,14 @@ async def toggle_like(product_id: str, current_user=Depends(get_current_user)):
 @api_router.post("/comments")
 async def create_comment(comment: CommentCreate, current_user=Depends(get_current_user)):
     try:
-        supabase = get_supabase()
         comment_data = {
             **comment.dict(),
             "id": str(uuid.uuid4()),
-            "user_id": current_user.id,
             "created_at": datetime.utcnow().isoformat()
         }
-        response = supabase.table("comments").insert(comment_data).execute()
-        return response.data[0]
+        return await storage.create_comment(current_user.id, comment_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -367,17 +524,12 @@ async def create_comment(comment: CommentCreate, current_user=Depends(get_curren
 @api_router.get("/messages")
 async def get_conversations(current_user=Depends(get_current_user)):
     try:
-        supabase = get_supabase()
         # Get all conversations for current user
-        response = supabase.table("messages").select("""
-            *,
-            sender:sender_id (full_name, avatar_base64),
-            recipient:recipient_id (full_name, avatar_base64)
-        """).or_(f"sender_id.eq.{current_user.id},recipient_id.eq.{current_user.id}").order("created_at", desc=True).execute()
+        messages = await storage.list_messages(current_user.id)
         
         # Group by conversation
         conversations = {}
-        for message in response.data:
+        for message in messages:
             other_user_id = message["recipient_id"] if message["sender_id"] == current_user.id else message["sender_id"]
             if other_user_id not in conversations:
                 conversations[other_user_id] = {
@@ -390,70 +542,383 @@ async def get_conversations(current_user=Depends(get_current_user)):
             conversations[other_user_id]["messages"].append(message)
         
         return list(conversations.values())
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/messages/{other_user_id}")
 async def get_conversation_messages(other_user_id: str, current_user=Depends(get_current_user)):
     try:
-        supabase = get_supabase()
-        response = supabase.table("messages").select("""
-            *,
-            sender:sender_id (full_name, avatar_base64),
-            recipient:recipient_id (full_name, avatar_base64)
-        """).or_(
-            f"and(sender_id.eq.{current_user.id},recipient_id.eq.{other_user_id}),and(sender_id.eq.{other_user_id},recipient_id.eq.{current_user.id})"
-        ).order("created_at", asc=True).execute()
-        
-        return response.data
+        return await storage.list_conversation(current_user.id, other_user_id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/messages")
 async def send_message(message: MessageCreate, current_user=Depends(get_current_user)):
     try:
-        supabase = get_supabase()
         message_data = {
             **message.dict(),
             "id": str(uuid.uuid4()),
-            "sender_id": current_user.id,
             "created_at": datetime.utcnow().isoformat()
         }
-        response = supabase.table("messages").insert(message_data).execute()
-        return response.data[0]
+        return await storage.create_message(current_user.id, message_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Orders / checkout
+ORDER_ERRORS = {
+    # SQLSTATE raised by place_order() -> HTTP status
+    "P0409": 409,  # insufficient_stock
+    "P0404": 404,  # product_not_found
+    "22023": 400,  # invalid_quantity / empty_cart
+}
+
+@api_router.post("/orders")
+async def place_order(
+    order: OrderCreate,
+    idempotency_key: str = Header(..., alias="Idempotency-Key", min_length=8, max_length=128),
+    current_user=Depends(get_current_user)
+):
+    """Reserve stock and create one order per cart item, atomically.
+
+    Retrying with the same Idempotency-Key returns the original result
+    (with ``replayed: true``) and never reserves stock twice.
+    """
+    try:
+        # place_order is only executable by the service role (see supabase_schema.sql)
+        supabase = get_service_supabase()
+        response = await execute(supabase.rpc("place_order", {
+            "p_buyer_id": current_user.id,
+            "p_idempotency_key": idempotency_key,
+            "p_items": [item.dict() for item in order.items],
+        }))
+        return response.data
+    except APIError as e:
+        if e.code in ORDER_ERRORS:
+            raise HTTPException(
+                status_code=ORDER_ERRORS[e.code],
+                detail={"error": e.message, "product_id": e.details}
+            )
+        raise HTTPException(status_code=500, detail=e.message)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/orders")
+async def get_orders(current_user=Depends(get_current_user)):
+    try:
+        supabase = get_supabase()
+        response = await execute_read(supabase.table("orders").select("*").or_(
+            f"buyer_id.eq.{current_user.id},seller_id.eq.{current_user.id}"
+        ).order("created_at", desc=True))
+        return {"orders": response.data, "count": len(response.data)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Supplier directory (precomputed aggregates, see supplier_directory in supabase_schema.sql)
+SUPPLIER_DIRECTORY_COLUMNS = (
+    "supplier_id, display_name, country, city, avatar_url, is_supplier_verified, "
+    "product_count, total_likes, categories, sample_products, sort_key"
+)
+
+def encode_cursor(sort_key: str) -> str:
+    return base64.urlsafe_b64encode(sort_key.encode()).decode()
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        # validate: urlsafe_b64decode would drop stray characters silently
+        return base64.b64decode(cursor.encode(), altchars=b"-_", validate=True).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@api_router.get("/suppliers")
+async def get_suppliers(
+    country: Optional[str] = None,
+    city: Optional[str] = None,
+    name: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None
+):
+    after = decode_cursor(cursor) if cursor else None
+    try:
+        supabase = get_supabase()
+        query = supabase.table("supplier_directory").select(SUPPLIER_DIRECTORY_COLUMNS)
+        
+        if country:
+            query = query.eq("country", country)
+        if city:
+            query = query.eq("city", city)
+        if name:
+            query = query.ilike("display_name", f"%{name}%")
+        if after:
+            query = query.gt("sort_key", after)
+        
+        # Fetch one extra row to know whether there is a next page
+        response = await execute_read(query.order("sort_key").limit(limit + 1))
+        rows = response.data[:limit]
+        next_cursor = encode_cursor(rows[-1]["sort_key"]) if len(response.data) > limit else None
+        suppliers = [{k: v for k, v in row.items() if k != "sort_key"} for row in rows]
+        return {"suppliers": suppliers, "count": len(suppliers), "next_cursor": next_cursor}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Supplier analytics (hourly/daily rollups, see analytics.py)
+ANALYTICS_REFRESH_SECONDS = int(os.getenv("ANALYTICS_REFRESH_SECONDS", "300"))
+STATS_DEFAULT_RANGE = {"day": timedelta(days=30), "hour": timedelta(hours=48)}
+
+async def refresh_analytics():
+    """Fold new likes, comments and messages into the rollups periodically."""
+    reader = None
+    while True:
+        try:
+            reader = reader or await run_in_threadpool(create_reader)
+            result = await run_in_threadpool(analytics_store.update, reader)
+            if not result.get("skipped"):
+                logger.info("Analytics rollups updated with %d events", result["events"])
+        except Exception as e:
+            logger.warning("Analytics update failed: %s", e)
+        await asyncio.sleep(ANALYTICS_REFRESH_SECONDS)
+
+@api_router.get("/suppliers/me/stats")
+async def get_supplier_stats(
+    granularity: str = Query("day", pattern="^(day|hour)$"),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    product_id: Optional[str] = None,
+    current_user=Depends(get_current_user)
+):
+    end = end or datetime.now(timezone.utc)
+    start = start or end - STATS_DEFAULT_RANGE[granularity]
+    # Naive timestamps are taken as UTC, like the rollup buckets
+    end = end if end.tzinfo else end.replace(tzinfo=timezone.utc)
+    start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+    
+    # Off the event loop: the first query after a refresh re-reads the Parquet file
+    stats = await run_in_threadpool(
+        analytics_store.supplier_stats, current_user.id, "daily" if granularity == "day" else "hourly", start, end, product_id
+    )
+    return {"granularity": granularity, "from": start.isoformat(), "to": end.isoformat(), **stats}
+
 # Categories
+CATEGORIES = [
+    "Électronique", "Mode", "Maison & Jardin", "Sports", "Automobile",
+    "Santé & Beauté", "Livres", "Jouets", "Alimentation", "Bijoux",
+    "Outils", "Musique", "Art", "Voyage", "Business"
+]
+
+# Countries and Cities (Francophone Africa)
+LOCATIONS = {
+    "Cameroun": ["Yaoundé", "Douala", "Bafoussam", "Bamenda", "Garoua"],
+    "Côte d'Ivoire": ["Abidjan", "Bouaké", "Daloa", "Korhogo", "Yamoussoukro"],
+    "Sénégal": ["Dakar", "Thiès", "Kaolack", "Saint-Louis", "Ziguinchor"],
+    "Mali": ["Bamako", "Sikasso", "Mopti", "Koutiala", "Kayes"],
+    "Burkina Faso": ["Ouagadougou", "Bobo-Dioulasso", "Koudougou", "Ouahigouya", "Banfora"],
+    "Niger": ["Niamey", "Zinder", "Maradi", "Agadez", "Tahoua"],
+    "Tchad": ["N'Djamena", "Moundou", "Sarh", "Abéché", "Kelo"],
+    "République Centrafricaine": ["Bangui", "Berbérati", "Carnot", "Bambari", "Bouar"],
+    "Gabon": ["Libreville", "Port-Gentil", "Franceville", "Oyem", "Moanda"],
+    "République du Congo": ["Brazzaville", "Pointe-Noire", "Dolisie", "Nkayi", "Impfondo"],
+    "RDC": ["Kinshasa", "Lubumbashi", "Mbuji-Mayi", "Kisangani", "Goma", "Bukavu", "Tshikapa", "Kikwit", "Mbandaka", "Matadi"]
+}
+
+# Static responses are rendered once per worker (during warm-up)
+_static_bodies: Dict[str, bytes] = {}
+
+def static_response(key: str, payload: Dict[str, Any]) -> Response:
+    body = _static_bodies.get(key)
+    if body is None:
+        body = _static_bodies[key] = JSONResponse(payload).body
+    return Response(content=body, media_type="application/json")
+
 @api_router.get("/categories")
 async def get_categories():
-    return {
-        "categories": [
-            "Électronique", "Mode", "Maison & Jardin", "Sports", "Automobile",
-            "Santé & Beauté", "Livres", "Jouets", "Alimentation", "Bijoux",
-            "Outils", "Musique", "Art", "Voyage", "Business"
-        ]
-    }
+    return static_response("categories", {"categories": CATEGORIES})
 
-# Countries and Cities (Francophone Africa)
 @api_router.get("/locations")
 async def get_locations():
+    return static_response("locations", {"countries": LOCATIONS})
+
+# Profiling (admin only, see profiling.py)
+PROFILE_SETTINGS_POLL_SECONDS = float(os.getenv("PROFILE_SETTINGS_POLL_SECONDS", "2"))
+PROFILE_MEDIA_TYPES = {"collapsed": "text/plain", "speedscope": "application/json", "html": "text/html"}
+
+class ProfilingSettings(BaseModel):
+    sample_rate: Optional[float] = Field(None, ge=0, le=1)
+    routes: Optional[List[str]] = None
+
+async def require_profiling_admin(x_profiling_token: Optional[str] = Header(None)):
+    if not request_profiler.is_admin(x_profiling_token):
+        raise HTTPException(status_code=403, detail="Profiling token required")
+    if not request_profiler.available:
+        raise HTTPException(status_code=501, detail="pyinstrument is not installed")
+
+def profile_response(session, fmt: str, filename: str) -> Response:
+    extension = {"collapsed": "txt", "speedscope": "speedscope.json", "html": "html"}[fmt]
+    return Response(
+        content=render(session, fmt),
+        media_type=PROFILE_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'}
+    )
+
+async def watch_profiling_settings():
+    """Pick up settings changed through any worker's admin endpoint."""
+    while True:
+        try:
+            request_profiler.reload_settings()
+        except Exception as e:
+            logger.warning("Profiling settings reload failed: %s", e)
+        await asyncio.sleep(PROFILE_SETTINGS_POLL_SECONDS)
+
+@api_router.get("/admin/profiling", dependencies=[Depends(require_profiling_admin)])
+async def get_profiling_settings():
+    return request_profiler.settings()
+
+@api_router.put("/admin/profiling", dependencies=[Depends(require_profiling_admin)])
+async def update_profiling_settings(settings: ProfilingSettings):
+    return await run_in_threadpool(request_profiler.configure, settings.sample_rate, settings.routes)
+
+@api_router.get("/admin/profiling/profiles", dependencies=[Depends(require_profiling_admin)])
+async def list_profiles(route: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    records = await run_in_threadpool(lambda: list(islice(request_profiler.profiles(route), limit)))
+    return {"profiles": [record["meta"] for record in records], "count": len(records)}
+
+@api_router.get("/admin/profiling/profiles/{profile_id}", dependencies=[Depends(require_profiling_admin)])
+async def export_profile(profile_id: str, format: str = Query("speedscope", pattern=f"^({'|'.join(EXPORT_FORMATS)})$")):
+    session = await run_in_threadpool(request_profiler.get, profile_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile_response(session, format, f"profile-{profile_id}")
+
+@api_router.get("/admin/profiling/aggregate", dependencies=[Depends(require_profiling_admin)])
+async def export_route_profile(
+    route: str,
+    window: int = Query(600, ge=1, le=7 * 24 * 3600),
+    format: str = Query("collapsed", pattern=f"^({'|'.join(EXPORT_FORMATS)})$")
+):
+    session = await run_in_threadpool(request_profiler.aggregate, route, window)
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profiles for this route in the window")
+    slug = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+    return profile_response(session, format, f"{slug}-{window}s")
+
+# Health / readiness
+warmup_state: Dict[str, Any] = {
+    "ready": False, "draining": False, "upstream": "unknown", "storage": "unknown", "started_at": None, "ready_at": None
+}
+
+async def retry_until_ok(name: str, check: Callable[[], Awaitable[Any]]) -> None:
+    """Retry ``check`` with backoff until it succeeds, recording its state in warmup_state[name]."""
+    delay = 0.2
+    while True:
+        try:
+            await asyncio.wait_for(check(), timeout=float(os.getenv("WARMUP_UPSTREAM_TIMEOUT", "2")))
+            warmup_state[name] = "ok"
+            return
+        except Exception as e:
+            warmup_state[name] = f"unreachable: {e.__class__.__name__}"
+            logger.warning("%s check failed during warm-up: %s", name.capitalize(), e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10)
+
+async def check_upstream() -> None:
+    """Build the client and retry a cheap query until it succeeds."""
+    await retry_until_ok(
+        "upstream", lambda: run_in_threadpool(lambda: get_supabase().table("products").select("id").limit(1).execute())
+    )
+
+async def connect_storage() -> None:
+    """Open the storage backend's connections (the Postgres pool) until it succeeds."""
+    await retry_until_ok("storage", storage.connect)
+
+async def become_ready() -> None:
+    """Mark the worker ready once both upstream and the storage backend answer."""
+    await asyncio.gather(check_upstream(), connect_storage())
+    if warmup_state["draining"]:
+        return
+    warmup_state["ready"] = True
+    warmup_state["ready_at"] = datetime.utcnow().isoformat()
+    logger.info("Worker %s ready", os.getpid())
+
+def start_draining() -> None:
+    """Fail readiness from the moment shutdown is asked for, so load balancers
+    stop routing here while the server drains in-flight requests."""
+    warmup_state["ready"] = False
+    warmup_state["draining"] = True
+
+def drain_on_sigterm() -> None:
+    """Run start_draining when SIGTERM arrives, ahead of the server's own handler.
+
+    Installed from startup, after uvicorn has set up its handlers: either a
+    plain signal handler, chained here, or an event-loop handler, which still
+    runs through the loop's wakeup fd.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def on_sigterm(signum, frame):
+        start_draining()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+@app.on_event("startup")
+async def warm_up():
+    warmup_state["started_at"] = datetime.utcnow().isoformat()
+    drain_on_sigterm()
+    static_response("categories", {"categories": CATEGORIES})
+    static_response("locations", {"countries": LOCATIONS})
+    # The client is built, the storage backend connected and connectivity
+    # checked in the background so the worker starts accepting connections
+    # immediately; /api/health/ready reports 503 until both pass.
+    app.state.warmup_task = asyncio.create_task(become_ready())
+    app.state.similarity_task = asyncio.create_task(refresh_similarity_index())
+    app.state.analytics_task = asyncio.create_task(refresh_analytics())
+    if request_profiler.available:
+        app.state.profiling_task = asyncio.create_task(watch_profiling_settings())
+
+@app.on_event("shutdown")
+async def shut_down():
+    start_draining()
+    for name in ("warmup_task", "similarity_task", "analytics_task", "profiling_task"):
+        task = getattr(app.state, name, None)
+        if task is not None and not task.done():
+            task.cancel()
+    await storage.close()
+
+@api_router.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+@api_router.get("/metrics")
+async def metrics():
     return {
-        "countries": {
-            "Cameroun": ["Yaoundé", "Douala", "Bafoussam", "Bamenda", "Garoua"],
-            "Côte d'Ivoire": ["Abidjan", "Bouaké", "Daloa", "Korhogo", "Yamoussoukro"],
-            "Sénégal": ["Dakar", "Thiès", "Kaolack", "Saint-Louis", "Ziguinchor"],
-            "Mali": ["Bamako", "Sikasso", "Mopti", "Koutiala", "Kayes"],
-            "Burkina Faso": ["Ouagadougou", "Bobo-Dioulasso", "Koudougou", "Ouahigouya", "Banfora"],
-            "Niger": ["Niamey", "Zinder", "Maradi", "Agadez", "Tahoua"],
-            "Tchad": ["N'Djamena", "Moundou", "Sarh", "Abéché", "Kelo"],
-            "République Centrafricaine": ["Bangui", "Berbérati", "Carnot", "Bambari", "Bouar"],
-            "Gabon": ["Libreville", "Port-Gentil", "Franceville", "Oyem", "Moanda"],
-            "République du Congo": ["Brazzaville", "Pointe-Noire", "Dolisie", "Nkayi", "Impfondo"],
-            "RDC": ["Kinshasa", "Lubumbashi", "Mbuji-Mayi", "Kisangani", "Goma", "Bukavu", "Tshikapa", "Kikwit", "Mbandaka", "Matadi"]
-        }
+        "singleflight": single_flight.stats(),
+        "upstream": upstream.stats(),
+        "similarity_index": similarity_index.stats(),
+        "storage": storage.stats(),
     }
 
+@api_router.get("/health/ready")
+async def readiness():
+    if not warmup_state["ready"]:
+        status = "draining" if warmup_state["draining"] else "warming_up"
+        return JSONResponse(status_code=503, content={"status": status, **warmup_state})
+    return {"status": "ok", **warmup_state}
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -465,6 +930,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request upstream deadline (see resilience.py)
+app.add_middleware(DeadlineMiddleware)
+
+# Compress JSON responses; product and message payloads embed base64 images
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+    offload_size=int(os.getenv("COMPRESSION_OFFLOAD_SIZE", str(64 * 1024))),
+    route_levels={
+        # Listing pages are large and hot: favour speed over ratio
+        "/api/products": {"gzip": 5, "br": 4},
+        "/api/messages": {"gzip": 6, "br": 5},
+    },
+)
+
+# Opt-in request profiling; outermost so profiles include the middleware above
+app.add_middleware(ProfilingMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -0,0 +1,71 @@
+"""Single-flight coalescing for identical read queries.
+
+When many requests ask for the same row or page at once (a shared product
+link, a popular category), only the first one sends its query to Supabase;
+the others await the same in-flight call and receive its result. Queries are
+keyed by HTTP method, table path, query parameters (filters, projection,
+ordering, range) and headers, so two requests share a call only if PostgREST
+would see exactly the same request.
+
+Coalesced callers receive the *same* response object: treat it as read-only.
+"""
+import asyncio
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.requests = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.coalesced_by_table: Dict[str, int] = defaultdict(int)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], label: str = "") -> Any:
+        """Await ``fn()``, sharing it with concurrent callers of ``key``.
+
+        ``fn()`` runs in its own task, owned by no caller: cancelling any
+        caller, the first one included, only stops that caller waiting.
+        """
+        self.requests += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            self.coalesced_by_table[label] += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self.upstream_calls += 1
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark retrieved so a failure nobody waited for is not logged as unhandled
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / self.requests, 4) if self.requests else 0.0,
+            "inflight": len(self._inflight),
+            "coalesced_by_table": dict(self.coalesced_by_table),
+        }
+
+
+def query_key(query) -> Tuple:
+    """Identity of a postgrest request builder: method, table, params and headers."""
+    return (
+        query.http_method,
+        query.path,
+        tuple(sorted(query.params.multi_items())),
+        tuple(sorted(query.headers.items())),
+    )
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,242 @@
+"""Storage backends for the main read/write paths of server.py.
+
+Endpoints for profiles, products, comments, likes and messages talk to a
+``Storage``. The backend is chosen with ``STORAGE_BACKEND``:
+
+* ``supabase`` (default): PostgREST through supabase-py, via the resilience
+  layer (see resilience.py).
+* ``postgres``: prepared SQL over asyncpg's binary protocol against
+  ``DATABASE_URL`` (see postgres_storage.py).
+
+Both return rows as PostgREST would: plain dicts with JSON-compatible values
+and embedded relations as nested dicts. Writes take the acting user's id and
+only touch rows that user may touch, so the Postgres backend, which connects
+past row-level security, enforces the same rules with explicit predicates.
+
+Returned rows may be shared with coalesced requests: treat them as read-only.
+"""
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from postgrest.exceptions import APIError
+
+from resilience import execute, execute_read
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+
+LIST_SUPPLIER_COLUMNS = ("username", "first_name", "last_name", "country", "city", "avatar_url")
+DETAIL_SUPPLIER_COLUMNS = ("full_name", "country", "city", "avatar_base64")
+AUTHOR_COLUMNS = ("full_name", "avatar_base64")
+
+# PostgREST's error for a column that is not in the table
+UNKNOWN_COLUMN = "PGRST204"
+
+
+class Storage(ABC):
+    name = ""
+
+    async def connect(self) -> None:
+        """Open connections ahead of the first request (optional)."""
+
+    async def close(self) -> None:
+        """Release connections on shutdown."""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+    # Profiles ------------------------------------------------------------
+
+    @abstractmethod
+    async def get_profile(self, user_id: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def update_profile(self, user_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]: ...
+
+    # Products ------------------------------------------------------------
+
+    @abstractmethod
+    async def list_products(
+        self,
+        category: Optional[str] = None,
+        country: Optional[str] = None,
+        city: Optional[str] = None,
+        search: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """Newest first, each with its supplier's public profile as ``profiles``."""
+
+    @abstractmethod
+    async def get_product(self, product_id: str) -> Optional[Dict[str, Any]]:
+        """One product with its supplier's profile as ``profiles``."""
+
+    @abstractmethod
+    async def get_product_owner(self, product_id: str) -> Optional[str]: ...
+
+    @abstractmethod
+    async def create_product(self, supplier_id: str, fields: Dict[str, Any]) -> Dict[str, Any]: ...
+
+    @abstractmethod
+    async def update_product(self, product_id: str, supplier_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Update a product owned by ``supplier_id``; None if there is none."""
+
+    @abstractmethod
+    async def delete_product(self, product_id: str, supplier_id: str) -> bool: ...
+
+    # Comments and likes --------------------------------------------------
+
+    @abstractmethod
+    async def list_comments(self, product_id: str) -> List[Dict[str, Any]]:
+        """Newest first, each with its author's profile as ``profiles``."""
+
+    @abstractmethod
+    async def create_comment(self, user_id: str, fields: Dict[str, Any]) -> Dict[str, Any]: ...
+
+    @abstractmethod
+    async def toggle_like(self, product_id: str, user_id: str) -> bool:
+        """Like or unlike; True when the product is now liked."""
+
+    # Messages ------------------------------------------------------------
+
+    @abstractmethod
+    async def list_messages(self, user_id: str) -> List[Dict[str, Any]]:
+        """Messages sent or received by ``user_id``, newest first, with ``sender``/``recipient``."""
+
+    @abstractmethod
+    async def list_conversation(self, user_id: str, other_user_id: str) -> List[Dict[str, Any]]:
+        """Messages between two users, oldest first, with ``sender``/``recipient``."""
+
+    @abstractmethod
+    async def create_message(self, sender_id: str, fields: Dict[str, Any]) -> Dict[str, Any]: ...
+
+
+def _embed(alias: str, fk: str, columns) -> str:
+    return f"{alias}:{fk} ({', '.join(columns)})"
+
+
+async def _write(query):
+    """``execute`` a write of caller-supplied fields; unknown columns are the caller's error."""
+    try:
+        return await execute(query)
+    except APIError as e:
+        if e.code == UNKNOWN_COLUMN:
+            raise HTTPException(status_code=400, detail=e.message)
+        raise
+
+
+class SupabaseStorage(Storage):
+    name = "supabase"
+
+    def __init__(self, client: Callable[[], Any]):
+        # The client is built lazily (see get_supabase in server.py)
+        self.client = client
+
+    def table(self, name: str):
+        return self.client().table(name)
+
+    async def get_profile(self, user_id):
+        response = await execute_read(self.table("profiles").select("*").eq("id", user_id))
+        return response.data[0] if response.data else None
+
+    async def update_profile(self, user_id, fields):
+        response = await _write(self.table("profiles").update(fields).eq("id", user_id))
+        return response.data[0] if response.data else None
+
+    async def list_products(self, category=None, country=None, city=None, search=None, limit=20, offset=0):
+        query = self.table("products").select(f"*, {_embed('profiles', 'supplier_id', LIST_SUPPLIER_COLUMNS)}")
+        if category:
+            query = query.eq("category", category)
+        if country:
+            query = query.eq("supplier_country", country)
+        if city:
+            query = query.eq("supplier_city", city)
+        if search:
+            query = query.ilike("name", f"%{search}%")
+        response = await execute_read(query.range(offset, offset + limit - 1).order("created_at", desc=True))
+        return response.data
+
+    async def get_product(self, product_id):
+        response = await execute_read(
+            self.table("products").select(f"*, {_embed('profiles', 'supplier_id', DETAIL_SUPPLIER_COLUMNS)}").eq("id", product_id)
+        )
+        return response.data[0] if response.data else None
+
+    async def get_product_owner(self, product_id):
+        response = await execute_read(self.table("products").select("supplier_id").eq("id", product_id))
+        return response.data[0]["supplier_id"] if response.data else None
+
+    async def create_product(self, supplier_id, fields):
+        response = await _write(self.table("products").insert({**fields, "supplier_id": supplier_id}))
+        return response.data[0]
+
+    async def update_product(self, product_id, supplier_id, fields):
+        response = await _write(
+            self.table("products").update(fields).eq("id", product_id).eq("supplier_id", supplier_id)
+        )
+        return response.data[0] if response.data else None
+
+    async def delete_product(self, product_id, supplier_id):
+        response = await execute(self.table("products").delete().eq("id", product_id).eq("supplier_id", supplier_id))
+        return bool(response.data)
+
+    async def list_comments(self, product_id):
+        response = await execute_read(
+            self.table("comments").select(f"*, {_embed('profiles', 'user_id', AUTHOR_COLUMNS)}")
+            .eq("product_id", product_id).order("created_at", desc=True)
+        )
+        return response.data
+
+    async def create_comment(self, user_id, fields):
+        response = await _write(self.table("comments").insert({**fields, "user_id": user_id}))
+        return response.data[0]
+
+    async def toggle_like(self, product_id, user_id):
+        existing = await execute_read(self.table("product_likes").select("*").eq("product_id", product_id).eq("user_id", user_id), fresh=True)
+        if existing.data:
+            await execute(self.table("product_likes").delete().eq("product_id", product_id).eq("user_id", user_id))
+            delta = -1
+        else:
+            await execute(self.table("product_likes").insert({"product_id": product_id, "user_id": user_id}))
+            delta = 1
+        product = await execute_read(self.table("products").select("likes_count").eq("id", product_id), fresh=True)
+        new_count = max(0, product.data[0]["likes_count"] + delta)
+        await execute(self.table("products").update({"likes_count": new_count}).eq("id", product_id))
+        return delta > 0
+
+    def _messages(self):
+        return self.table("messages").select(
+            f"*, {_embed('sender', 'sender_id', AUTHOR_COLUMNS)}, {_embed('recipient', 'recipient_id', AUTHOR_COLUMNS)}"
+        )
+
+    async def list_messages(self, user_id):
+        response = await execute_read(
+            self._messages().or_(f"sender_id.eq.{user_id},recipient_id.eq.{user_id}").order("created_at", desc=True)
+        )
+        return response.data
+
+    async def list_conversation(self, user_id, other_user_id):
+        response = await execute_read(self._messages().or_(
+            f"and(sender_id.eq.{user_id},recipient_id.eq.{other_user_id}),"
+            f"and(sender_id.eq.{other_user_id},recipient_id.eq.{user_id})"
+        ).order("created_at"))
+        return response.data
+
+    async def create_message(self, sender_id, fields):
+        response = await _write(self.table("messages").insert({**fields, "sender_id": sender_id}))
+        return response.data[0]
+
+
+def create_storage(client: Callable[[], Any], backend: str = STORAGE_BACKEND) -> Storage:
+    """Build the configured backend; ``client`` returns the shared Supabase client."""
+    if backend == "supabase":
+        return SupabaseStorage(client)
+    if backend == "postgres":
+        from postgres_storage import PostgresStorage
+
+        dsn = os.getenv("DATABASE_URL")
+        if not dsn:
+            raise RuntimeError("STORAGE_BACKEND=postgres requires DATABASE_URL")
+        return PostgresStorage(dsn)
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {backend!r} (expected 'supabase' or 'postgres')")
@@ -0,0 +1,222 @@
+"""Streaming multipart parsing for product uploads.
+
+``POST/PUT /api/products`` accept ``multipart/form-data`` with a ``product``
+part holding the JSON product fields and an optional binary ``image`` part.
+The body is parsed as it arrives: the image is written chunk by chunk to a
+temporary file (size limit and type checks enforced while reading) and then
+streamed from disk to Supabase Storage, so peak memory per upload does not
+depend on the image size. Storage calls go through the upstream guard like
+every other Supabase call.
+"""
+import json
+import os
+import tempfile
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+import multipart
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import parse_options_header
+from fastapi import HTTPException, Request
+
+from resilience import call_upstream
+
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
+MAX_FIELDS_BYTES = 64 * 1024
+PRODUCT_IMAGES_BUCKET = os.getenv("PRODUCT_IMAGES_BUCKET", "product-images")
+
+ALLOWED_IMAGE_TYPES = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Detect the image type from its first bytes."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def is_multipart(request: Request) -> bool:
+    return request.headers.get("content-type", "").startswith("multipart/form-data")
+
+
+class ImageUpload:
+    """An uploaded image spooled to a temporary file on disk."""
+
+    def __init__(self, content_type: str):
+        self.content_type = content_type
+        self.size = 0
+        self.file = tempfile.TemporaryFile()
+        self._head = b""
+
+    @property
+    def extension(self) -> str:
+        return ALLOWED_IMAGE_TYPES[self.content_type]
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > MAX_IMAGE_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image exceeds the maximum size of {MAX_IMAGE_BYTES} bytes",
+            )
+        if len(self._head) < 12:
+            self._head += data[:12 - len(self._head)]
+            if len(self._head) >= 12 and sniff_image_type(self._head) != self.content_type:
+                raise HTTPException(status_code=415, detail="Image content does not match its content type")
+        self.file.write(data)
+
+    def finish(self) -> None:
+        if self.size == 0:
+            raise HTTPException(status_code=400, detail="Image part is empty")
+        if len(self._head) < 12 and sniff_image_type(self._head) != self.content_type:
+            raise HTTPException(status_code=415, detail="Image content does not match its content type")
+        self.file.seek(0)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class _ProductPartsParser:
+    """Callbacks for multipart.MultipartParser, following starlette.formparsers."""
+
+    def __init__(self):
+        self.fields: Optional[Dict[str, Any]] = None
+        self.image: Optional[ImageUpload] = None
+        self._fields_buffer = bytearray()
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._part_name: Optional[str] = None
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+        self._part_name = None
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._part_name = options.get(b"name", b"").decode("latin-1")
+        if self._part_name == "image":
+            if self.image is not None:
+                raise HTTPException(status_code=400, detail="Only one image part is allowed")
+            content_type = self._headers.get(b"content-type", b"").decode("latin-1").split(";")[0].strip()
+            if content_type not in ALLOWED_IMAGE_TYPES:
+                raise HTTPException(
+                    status_code=415,
+                    detail=f"Unsupported image type; allowed: {', '.join(ALLOWED_IMAGE_TYPES)}",
+                )
+            self.image = ImageUpload(content_type)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._part_name == "image":
+            self.image.write(data[start:end])
+        elif self._part_name == "product":
+            self._fields_buffer += data[start:end]
+            if len(self._fields_buffer) > MAX_FIELDS_BYTES:
+                raise HTTPException(status_code=413, detail="Product fields are too large")
+
+    def on_part_end(self) -> None:
+        if self._part_name == "image":
+            self.image.finish()
+        elif self._part_name == "product":
+            try:
+                self.fields = json.loads(self._fields_buffer)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="The product part must be valid JSON")
+            if not isinstance(self.fields, dict):
+                raise HTTPException(status_code=400, detail="The product part must be a JSON object")
+
+
+async def parse_product_multipart(request: Request) -> Tuple[Dict[str, Any], Optional[ImageUpload]]:
+    """Stream-parse a multipart product request into (fields, image)."""
+    content_length = request.headers.get("content-length")
+    if content_length and not content_length.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if content_length and int(content_length) > MAX_IMAGE_BYTES + MAX_FIELDS_BYTES + 16 * 1024:
+        raise HTTPException(status_code=413, detail="Request body is too large")
+
+    _, params = parse_options_header(request.headers["content-type"])
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Missing multipart boundary")
+
+    handler = _ProductPartsParser()
+    parser = multipart.MultipartParser(boundary, {
+        "on_part_begin": handler.on_part_begin,
+        "on_part_data": handler.on_part_data,
+        "on_part_end": handler.on_part_end,
+        "on_header_field": handler.on_header_field,
+        "on_header_value": handler.on_header_value,
+        "on_header_end": handler.on_header_end,
+        "on_headers_finished": handler.on_headers_finished,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except Exception as e:
+        if handler.image is not None:
+            handler.image.close()
+        if isinstance(e, MultipartParseError):
+            raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+        raise
+
+    if handler.fields is None:
+        if handler.image is not None:
+            handler.image.close()
+        raise HTTPException(status_code=400, detail="Missing 'product' part")
+    return handler.fields, handler.image
+
+
+async def store_product_image(supabase, supplier_id: str, product_id: str, image: ImageUpload) -> str:
+    """Upload the spooled image to Supabase Storage and return its public URL."""
+    path = f"{supplier_id}/{product_id}/{uuid.uuid4()}.{image.extension}"
+    storage = supabase.storage.from_(PRODUCT_IMAGES_BUCKET)
+    # storage3 streams BufferedReader objects from disk in chunks
+    reader = open(image.file.fileno(), "rb", closefd=False)
+    try:
+        await call_upstream(
+            lambda: storage.upload(path, reader, {"content-type": image.content_type, "cache-control": "31536000"}),
+            "storage:upload",
+        )
+    finally:
+        reader.close()
+    return storage.get_public_url(path)
+
+
+def product_image_path(image_url: Optional[str]) -> Optional[str]:
+    """The object path of a public URL from ``store_product_image``; None for any other URL."""
+    if not image_url:
+        return None
+    _, found, path = image_url.partition(f"/object/public/{PRODUCT_IMAGES_BUCKET}/")
+    path = path.split("?")[0]
+    return path if found and path else None
+
+
+async def remove_product_image(supabase, image_url: Optional[str]) -> None:
+    """Delete a stored image by its public URL; URLs outside the bucket are left alone."""
+    path = product_image_path(image_url)
+    if path is not None:
+        storage = supabase.storage.from_(PRODUCT_IMAGES_BUCKET)
+        await call_upstream(lambda: storage.remove([path]), "storage:remove", idempotent=True)
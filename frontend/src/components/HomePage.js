@@ -207,10 +207,10 @@ const HomePage = () => {
                 onClick={() => handleProductClick(product.id)}
                 className="bg-card-dark rounded-lg border border-gray-700 overflow-hidden card-hover cursor-pointer"
               >
-                {product.image_base64 && (
+                {(product.image_url || product.image_base64) && (
                   <div className="h-48 bg-gray-800">
                     <img
-                      src={`data:image/jpeg;base64,${product.image_base64}`}
+                      src={product.image_url || `data:image/jpeg;base64,${product.image_base64}`}
                       alt={product.name}
                       className="w-full h-full object-cover"
                     />
@@ -17,6 +17,7 @@ const ProductDetail = () => {
   const [liked, setLiked] = useState(false)
   const [comment, setComment] = useState('')
   const [sendingComment, setSendingComment] = useState(false)
+  const [similarProducts, setSimilarProducts] = useState([])
 
   const { user } = useAuth()
   const navigate = useNavigate()
@@ -24,6 +25,7 @@ const ProductDetail = () => {
   useEffect(() => {
     if (id) {
       fetchProduct()
+      fetchSimilarProducts()
     }
   }, [id])
 
@@ -38,6 +40,17 @@ const ProductDetail = () => {
     }
   }
 
+  const fetchSimilarProducts = async () => {
+    try {
+      const response = await axios.get(`${API_BASE}/api/products/${id}/similar`, {
+        params: { limit: 6 }
+      })
+      setSimilarProducts(response.data.products)
+    } catch (error) {
+      console.error('Error fetching similar products:', error)
+    }
+  }
+
   const handleLike = async () => {
     try {
       const token = (await supabase.auth.getSession()).data.session?.access_token
@@ -134,9 +147,9 @@ const ProductDetail = () => {
 
       {/* Product Image */}
       <div className="h-80 bg-gray-800">
-        {product.image_base64 ? (
+        {product.image_url || product.image_base64 ? (
           <img
-            src={`data:image/jpeg;base64,${product.image_base64}`}
+            src={product.image_url || `data:image/jpeg;base64,${product.image_base64}`}
             alt={product.name}
             className="w-full h-full object-cover"
           />
@@ -250,6 +263,40 @@ const ProductDetail = () => {
           </div>
         </div>
 
+        {/* Similar Products */}
+        {similarProducts.length > 0 && (
+          <div>
+            <h3 className="text-lg font-semibold text-white mb-3">Produits similaires</h3>
+            <div className="flex gap-3 overflow-x-auto pb-2">
+              {similarProducts.map((similar) => (
+                <div
+                  key={similar.id}
+                  onClick={() => navigate(`/product/${similar.id}`)}
+                  className="w-36 flex-shrink-0 bg-gray-800 rounded-lg overflow-hidden cursor-pointer card-hover"
+                >
+                  <div className="h-24 bg-gray-700">
+                    {similar.image_url || similar.image_base64 ? (
+                      <img
+                        src={similar.image_url || `data:image/jpeg;base64,${similar.image_base64}`}
+                        alt={similar.name}
+                        className="w-full h-full object-cover"
+                      />
+                    ) : (
+                      <div className="w-full h-full flex items-center justify-center">
+                        <Package className="h-8 w-8 text-gray-400" />
+                      </div>
+                    )}
+                  </div>
+                  <div className="p-2">
+                    <p className="text-sm text-white truncate">{similar.name}</p>
+                    <p className="text-sm text-indigo-400 font-semibold">${similar.price}</p>
+                  </div>
+                </div>
+              ))}
+            </div>
+          </div>
+        )}
+
         {/* Comments Section */}
         <div>
           <h3 className="text-lg font-semibold text-white mb-3">
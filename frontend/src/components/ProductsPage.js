@@ -142,10 +142,10 @@ const ProductsPage = () => {
                 className="bg-card-dark border border-gray-700 rounded-lg p-4 card-hover"
               >
                 <div className="flex gap-4">
-                  {product.image_base64 && (
+                  {(product.image_url || product.image_base64) && (
                     <div className="w-20 h-20 bg-gray-800 rounded-lg overflow-hidden flex-shrink-0">
                       <img
-                        src={`data:image/jpeg;base64,${product.image_base64}`}
+                        src={product.image_url || `data:image/jpeg;base64,${product.image_base64}`}
                         alt={product.name}
                         className="w-full h-full object-cover"
                       />
@@ -223,9 +223,10 @@ const CreateProductModal = ({ onClose, onSuccess, categories }) => {
     description: '',
     price: '',
     category: '',
-    stock_quantity: 1,
-    image_base64: ''
+    stock_quantity: 1
   })
+  const [imageFile, setImageFile] = useState(null)
+  const [imagePreview, setImagePreview] = useState('')
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState('')
 
@@ -237,10 +238,17 @@ const CreateProductModal = ({ onClose, onSuccess, categories }) => {
     try {
       const token = (await supabase.auth.getSession()).data.session?.access_token
       
-      await axios.post(`${API_BASE}/api/products`, {
+      // Send the image as a binary multipart part rather than base64 in JSON
+      const body = new FormData()
+      body.append('product', JSON.stringify({
         ...formData,
         price: parseFloat(formData.price)
-      }, {
+      }))
+      if (imageFile) {
+        body.append('image', imageFile)
+      }
+
+      await axios.post(`${API_BASE}/api/products`, body, {
         headers: { Authorization: `Bearer ${token}` }
       })
 
@@ -255,12 +263,11 @@ const CreateProductModal = ({ onClose, onSuccess, categories }) => {
   const handleImageChange = (e) => {
     const file = e.target.files[0]
     if (file) {
-      const reader = new FileReader()
-      reader.onload = (e) => {
-        const base64 = e.target.result.split(',')[1]
-        setFormData(prev => ({ ...prev, image_base64: base64 }))
+      if (imagePreview) {
+        URL.revokeObjectURL(imagePreview)
       }
-      reader.readAsDataURL(file)
+      setImageFile(file)
+      setImagePreview(URL.createObjectURL(file))
     }
   }
 
@@ -332,13 +339,13 @@ const CreateProductModal = ({ onClose, onSuccess, categories }) => {
             <label className="block text-gray-300 text-sm mb-2">Image du produit</label>
             <input
               type="file"
-              accept="image/*"
+              accept="image/jpeg,image/png,image/webp,image/gif"
               onChange={handleImageChange}
               className="w-full px-3 py-2 bg-gray-800 border border-gray-600 rounded-lg text-white file:bg-indigo-600 file:text-white file:border-0 file:px-4 file:py-2 file:rounded-lg file:mr-4"
             />
-            {formData.image_base64 && (
+            {imagePreview && (
               <img
-                src={`data:image/jpeg;base64,${formData.image_base64}`}
+                src={imagePreview}
                 alt="Preview"
                 className="mt-2 image-preview"
               />
@@ -8,7 +8,9 @@ const API_BASE = process.env.REACT_APP_BACKEND_URL
 
 const SuppliersPage = () => {
   const [suppliers, setSuppliers] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
   const [loading, setLoading] = useState(true)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [searchTerm, setSearchTerm] = useState('')
   const [selectedCountry, setSelectedCountry] = useState('')
   const [locations, setLocations] = useState({})
@@ -17,51 +19,47 @@ const SuppliersPage = () => {
   const navigate = useNavigate()
 
   useEffect(() => {
-    fetchData()
+    fetchLocations()
   }, [])
 
-  const fetchData = async () => {
+  useEffect(() => {
+    // Debounce typing so the directory is queried once per pause
+    const timer = setTimeout(() => fetchSuppliers(), 300)
+    return () => clearTimeout(timer)
+  }, [searchTerm, selectedCountry])
+
+  const fetchLocations = async () => {
     try {
-      const [productsRes, locationsRes] = await Promise.all([
-        axios.get(`${API_BASE}/api/products`),
-        axios.get(`${API_BASE}/api/locations`)
-      ])
-      
-      // Extract unique suppliers from products
-      const supplierMap = new Map()
-      
-      productsRes.data.products.forEach(product => {
-        if (product.profiles && product.supplier_id) {
-          const supplierId = product.supplier_id
-          if (!supplierMap.has(supplierId)) {
-            supplierMap.set(supplierId, {
-              id: supplierId,
-              full_name: product.profiles.full_name,
-              country: product.profiles.country,
-              city: product.profiles.city,
-              avatar_base64: product.profiles.avatar_base64,
-              products: []
-            })
-          }
-          supplierMap.get(supplierId).products.push(product)
-        }
-      })
-      
-      setSuppliers(Array.from(supplierMap.values()))
-      setLocations(locationsRes.data.countries)
+      const response = await axios.get(`${API_BASE}/api/locations`)
+      setLocations(response.data.countries)
+    } catch (error) {
+      console.error('Error fetching locations:', error)
+    }
+  }
+
+  const fetchSuppliers = async (cursor = null) => {
+    try {
+      if (cursor) {
+        setLoadingMore(true)
+      } else {
+        setLoading(true)
+      }
+      const params = {}
+      if (searchTerm) params.name = searchTerm
+      if (selectedCountry) params.country = selectedCountry
+      if (cursor) params.cursor = cursor
+
+      const response = await axios.get(`${API_BASE}/api/suppliers`, { params })
+      setSuppliers(prev => cursor ? [...prev, ...response.data.suppliers] : response.data.suppliers)
+      setNextCursor(response.data.next_cursor)
     } catch (error) {
       console.error('Error fetching suppliers:', error)
     } finally {
       setLoading(false)
+      setLoadingMore(false)
     }
   }
 
-  const filteredSuppliers = suppliers.filter(supplier => {
-    const matchesSearch = supplier.full_name.toLowerCase().includes(searchTerm.toLowerCase())
-    const matchesCountry = !selectedCountry || supplier.country === selectedCountry
-    return matchesSearch && matchesCountry
-  })
-
   const handleContactSupplier = (supplierId) => {
     navigate(`/messages?contact=${supplierId}`)
   }
@@ -101,7 +99,7 @@ const SuppliersPage = () => {
         </div>
 
         <p className="text-gray-400 text-sm mt-2">
-          {filteredSuppliers.length} fournisseur(s) dans votre région
+          {suppliers.length} fournisseur(s) dans votre région
         </p>
       </div>
 
@@ -111,7 +109,7 @@ const SuppliersPage = () => {
           <div className="flex justify-center items-center py-20">
             <div className="spinner"></div>
           </div>
-        ) : filteredSuppliers.length === 0 ? (
+        ) : suppliers.length === 0 ? (
           <div className="text-center py-20">
             <User className="h-16 w-16 text-gray-400 mx-auto mb-4" />
             <p className="text-gray-400 text-lg">Aucun fournisseur trouvé</p>
@@ -119,18 +117,18 @@ const SuppliersPage = () => {
           </div>
         ) : (
           <div className="space-y-4">
-            {filteredSuppliers.map((supplier) => (
+            {suppliers.map((supplier) => (
               <div
-                key={supplier.id}
+                key={supplier.supplier_id}
                 className="bg-card-dark border border-gray-700 rounded-lg p-6 card-hover"
               >
                 <div className="flex items-start gap-4">
                   {/* Avatar */}
                   <div className="w-16 h-16 bg-gray-700 rounded-full flex items-center justify-center flex-shrink-0">
-                    {supplier.avatar_base64 ? (
+                    {supplier.avatar_url ? (
                       <img
-                        src={`data:image/jpeg;base64,${supplier.avatar_base64}`}
-                        alt={supplier.full_name}
+                        src={supplier.avatar_url}
+                        alt={supplier.display_name}
                         className="w-full h-full rounded-full object-cover"
                       />
                     ) : (
@@ -142,7 +140,7 @@ const SuppliersPage = () => {
                   <div className="flex-1 min-w-0">
                     <div className="flex justify-between items-start mb-2">
                       <h3 className="text-xl font-semibold text-white">
-                        {supplier.full_name}
+                        {supplier.display_name}
                       </h3>
                       <div className="flex items-center gap-1 text-yellow-400">
                         <Star className="h-4 w-4 fill-current" />
@@ -158,7 +156,7 @@ const SuppliersPage = () => {
                     <div className="flex items-center gap-4 mb-4">
                       <div className="flex items-center gap-1 text-gray-400">
                         <Package className="h-4 w-4" />
-                        <span className="text-sm">{supplier.products.length} produit(s)</span>
+                        <span className="text-sm">{supplier.product_count} produit(s)</span>
                       </div>
                       <div className="text-green-400 text-sm">
                         ● En ligne
@@ -169,15 +167,15 @@ const SuppliersPage = () => {
                     <div className="mb-4">
                       <h4 className="text-gray-300 text-sm font-medium mb-2">Produits récents :</h4>
                       <div className="flex gap-2 overflow-x-auto">
-                        {supplier.products.slice(0, 3).map((product, index) => (
-                          <div key={index} className="flex-shrink-0 bg-gray-800 rounded px-2 py-1">
+                        {supplier.sample_products.map((product) => (
+                          <div key={product.id} className="flex-shrink-0 bg-gray-800 rounded px-2 py-1">
                             <span className="text-xs text-gray-300">{product.name}</span>
                           </div>
                         ))}
-                        {supplier.products.length > 3 && (
+                        {supplier.product_count > supplier.sample_products.length && (
                           <div className="flex-shrink-0 bg-gray-800 rounded px-2 py-1">
                             <span className="text-xs text-gray-400">
-                              +{supplier.products.length - 3} autres
+                              +{supplier.product_count - supplier.sample_products.length} autres
                             </span>
                           </div>
                         )}
@@ -187,14 +185,14 @@ const SuppliersPage = () => {
                     {/* Action Buttons */}
                     <div className="flex gap-2">
                       <button
-                        onClick={() => handleContactSupplier(supplier.id)}
+                        onClick={() => handleContactSupplier(supplier.supplier_id)}
                         className="flex-1 btn-primary py-2 px-4 rounded-lg text-white flex items-center justify-center gap-2"
                       >
                         <MessageCircle className="h-4 w-4" />
                         Contacter
                       </button>
                       <button
-                        onClick={() => navigate(`/products?supplier=${supplier.id}`)}
+                        onClick={() => navigate(`/products?supplier=${supplier.supplier_id}`)}
                         className="flex-1 bg-gray-700 py-2 px-4 rounded-lg text-white hover:bg-gray-600 transition-colors flex items-center justify-center gap-2"
                       >
                         <Package className="h-4 w-4" />
@@ -205,6 +203,15 @@ const SuppliersPage = () => {
                 </div>
               </div>
             ))}
+            {nextCursor && (
+              <button
+                onClick={() => fetchSuppliers(nextCursor)}
+                disabled={loadingMore}
+                className="w-full bg-gray-700 py-2 text-white rounded-lg hover:bg-gray-600 transition-colors disabled:opacity-50"
+              >
+                {loadingMore ? 'Chargement...' : 'Voir plus de fournisseurs'}
+              </button>
+            )}
           </div>
         )}
 
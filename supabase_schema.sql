@@ -30,7 +30,8 @@ CREATE TABLE products (
   price DECIMAL(10,2) NOT NULL,
   category TEXT NOT NULL,
   image_base64 TEXT,
-  stock_quantity INTEGER NOT NULL DEFAULT 1,
+  image_url TEXT,
+  stock_quantity INTEGER NOT NULL DEFAULT 1 CHECK (stock_quantity >= 0),
   supplier_country TEXT,
   supplier_city TEXT,
   likes_count INTEGER DEFAULT 0,
@@ -66,13 +67,15 @@ CREATE TABLE messages (
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
--- Create orders table (for future use)
+-- Create orders table (one row per cart item, grouped by checkout_id)
 CREATE TABLE orders (
   id TEXT PRIMARY KEY DEFAULT gen_random_uuid()::text,
   buyer_id UUID REFERENCES auth.users ON DELETE CASCADE NOT NULL,
   seller_id UUID REFERENCES auth.users ON DELETE CASCADE NOT NULL,
   product_id TEXT REFERENCES products ON DELETE CASCADE NOT NULL,
+  checkout_id TEXT,
   quantity INTEGER NOT NULL DEFAULT 1,
+  unit_price DECIMAL(10,2),
   total_amount DECIMAL(10,2) NOT NULL,
   status TEXT NOT NULL DEFAULT 'pending',
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
@@ -209,4 +212,274 @@ CREATE TRIGGER profiles_updated_at
 
 CREATE TRIGGER orders_updated_at
   BEFORE UPDATE ON orders
-  FOR EACH ROW EXECUTE PROCEDURE public.handle_updated_at();
\ No newline at end of file
+  FOR EACH ROW EXECUTE PROCEDURE public.handle_updated_at();
+-- Storage bucket for product images uploaded as multipart (served by public URL)
+INSERT INTO storage.buckets (id, name, public)
+VALUES ('product-images', 'product-images', true)
+ON CONFLICT (id) DO NOTHING;
+
+CREATE POLICY "Anyone can view product images" ON storage.objects
+  FOR SELECT USING (bucket_id = 'product-images');
+
+-- Only the API uploads, with the service role key, after its own size and
+-- type checks (backend/uploads.py); the public anon key cannot write here
+DROP POLICY IF EXISTS "API can upload product images" ON storage.objects;
+CREATE POLICY "API can upload product images" ON storage.objects
+  FOR INSERT TO service_role WITH CHECK (bucket_id = 'product-images');
+
+-- Supplier directory served by /api/suppliers: one row per supplier with
+-- precomputed aggregates, kept up to date by triggers on products and profiles
+CREATE TABLE IF NOT EXISTS supplier_directory (
+  supplier_id UUID PRIMARY KEY REFERENCES auth.users ON DELETE CASCADE,
+  display_name TEXT NOT NULL DEFAULT '',
+  country TEXT,
+  city TEXT,
+  avatar_url TEXT,
+  is_supplier_verified BOOLEAN DEFAULT FALSE,
+  product_count INTEGER NOT NULL DEFAULT 0,
+  total_likes INTEGER NOT NULL DEFAULT 0,
+  categories TEXT[] NOT NULL DEFAULT '{}',
+  sample_products JSONB NOT NULL DEFAULT '[]',
+  sort_key TEXT NOT NULL,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_supplier_directory_sort_key ON supplier_directory(sort_key);
+CREATE INDEX IF NOT EXISTS idx_supplier_directory_location ON supplier_directory(country, city, sort_key);
+
+ALTER TABLE supplier_directory ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Anyone can view supplier directory" ON supplier_directory
+  FOR SELECT USING (true);
+
+-- Recompute one supplier's row from its profile and products
+CREATE OR REPLACE FUNCTION public.refresh_supplier_directory(target UUID)
+RETURNS VOID AS $$
+DECLARE
+  profile JSONB;
+  v_name TEXT;
+  n_products INTEGER;
+BEGIN
+  IF target IS NULL THEN
+    RETURN;
+  END IF;
+
+  -- Serialise writers of this supplier's row (see handle_product_directory_change)
+  -- before reading: under READ COMMITTED each statement below then sees every
+  -- write committed ahead of us, so a concurrent insert or like delta is never
+  -- overwritten by aggregates from an older snapshot
+  PERFORM pg_advisory_xact_lock(hashtext('supplier_directory'), hashtext(target::text));
+
+  -- to_jsonb tolerates both profile layouts (full_name or first/last/username)
+  SELECT to_jsonb(p) INTO profile FROM profiles p WHERE p.id = target;
+  SELECT count(*) INTO n_products FROM products WHERE supplier_id = target;
+
+  IF n_products = 0 AND coalesce(profile ->> 'user_type', '') <> 'supplier' THEN
+    DELETE FROM supplier_directory WHERE supplier_id = target;
+    RETURN;
+  END IF;
+
+  v_name := coalesce(
+    nullif(profile ->> 'full_name', ''),
+    nullif(trim(coalesce(profile ->> 'first_name', '') || ' ' || coalesce(profile ->> 'last_name', '')), ''),
+    profile ->> 'username',
+    ''
+  );
+
+  INSERT INTO supplier_directory AS d (
+    supplier_id, display_name, country, city, avatar_url, is_supplier_verified,
+    product_count, total_likes, categories, sample_products, sort_key, updated_at
+  )
+  SELECT
+    target,
+    v_name,
+    profile ->> 'country',
+    profile ->> 'city',
+    profile ->> 'avatar_url',
+    coalesce((profile ->> 'is_supplier_verified')::boolean, FALSE),
+    n_products,
+    (SELECT coalesce(sum(likes_count), 0) FROM products WHERE supplier_id = target),
+    (SELECT coalesce(array_agg(DISTINCT category ORDER BY category), '{}') FROM products
+      WHERE supplier_id = target AND category IS NOT NULL),
+    (SELECT coalesce(jsonb_agg(jsonb_build_object('id', s.id, 'name', s.name) ORDER BY s.created_at DESC), '[]')
+      FROM (SELECT id, name, created_at FROM products
+            WHERE supplier_id = target ORDER BY created_at DESC LIMIT 3) s),
+    lower(v_name) || ' ' || target::text,
+    NOW()
+  ON CONFLICT (supplier_id) DO UPDATE SET
+    display_name = EXCLUDED.display_name,
+    country = EXCLUDED.country,
+    city = EXCLUDED.city,
+    avatar_url = EXCLUDED.avatar_url,
+    is_supplier_verified = EXCLUDED.is_supplier_verified,
+    product_count = EXCLUDED.product_count,
+    total_likes = EXCLUDED.total_likes,
+    categories = EXCLUDED.categories,
+    sample_products = EXCLUDED.sample_products,
+    sort_key = EXCLUDED.sort_key,
+    updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Only the triggers below (running as the owner) refresh rows
+REVOKE EXECUTE ON FUNCTION public.refresh_supplier_directory(UUID) FROM PUBLIC, anon, authenticated;
+
+CREATE OR REPLACE FUNCTION public.handle_product_directory_change()
+RETURNS TRIGGER AS $$
+BEGIN
+  -- Likes are the hot path: apply them as a delta instead of a full refresh
+  IF TG_OP = 'UPDATE'
+     AND NEW.supplier_id = OLD.supplier_id
+     AND NEW.name IS NOT DISTINCT FROM OLD.name
+     AND NEW.category IS NOT DISTINCT FROM OLD.category THEN
+    IF NEW.likes_count IS DISTINCT FROM OLD.likes_count THEN
+      -- Same lock as refresh_supplier_directory, so a refresh in flight
+      -- either sees this like or has its row updated by it afterwards
+      PERFORM pg_advisory_xact_lock(hashtext('supplier_directory'), hashtext(NEW.supplier_id::text));
+      UPDATE supplier_directory
+        SET total_likes = total_likes + coalesce(NEW.likes_count, 0) - coalesce(OLD.likes_count, 0)
+        WHERE supplier_id = NEW.supplier_id;
+    END IF;
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM public.refresh_supplier_directory(NEW.supplier_id);
+  END IF;
+  IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.supplier_id <> OLD.supplier_id) THEN
+    PERFORM public.refresh_supplier_directory(OLD.supplier_id);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION public.handle_profile_directory_change()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM public.refresh_supplier_directory(NEW.id);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS products_supplier_directory ON products;
+CREATE TRIGGER products_supplier_directory
+  AFTER INSERT OR UPDATE OR DELETE ON products
+  FOR EACH ROW EXECUTE PROCEDURE public.handle_product_directory_change();
+
+DROP TRIGGER IF EXISTS profiles_supplier_directory ON profiles;
+CREATE TRIGGER profiles_supplier_directory
+  AFTER INSERT OR UPDATE ON profiles
+  FOR EACH ROW EXECUTE PROCEDURE public.handle_profile_directory_change();
+
+-- Backfill existing suppliers
+SELECT public.refresh_supplier_directory(id) FROM (
+  SELECT id FROM profiles WHERE user_type = 'supplier'
+  UNION
+  SELECT DISTINCT supplier_id FROM products
+) suppliers;
+
+-- Checkouts: one row per (buyer, client idempotency key) holding the result
+-- returned by place_order, so retried requests get the same answer
+CREATE TABLE IF NOT EXISTS checkouts (
+  id TEXT PRIMARY KEY DEFAULT gen_random_uuid()::text,
+  buyer_id UUID REFERENCES auth.users ON DELETE CASCADE NOT NULL,
+  idempotency_key TEXT NOT NULL,
+  result JSONB,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  UNIQUE(buyer_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_orders_checkout_id ON orders(checkout_id);
+
+ALTER TABLE checkouts ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own checkouts" ON checkouts
+  FOR SELECT USING (auth.uid() = buyer_id);
+
+-- Place a multi-item order in one transaction. Each item reserves stock with
+-- a single conditional UPDATE (no read-then-write), rows are locked in
+-- product id order so concurrent carts cannot deadlock, and any shortfall
+-- raises and rolls back the whole cart. Replays of an idempotency key
+-- return the stored result without touching stock again.
+CREATE OR REPLACE FUNCTION public.place_order(p_buyer_id UUID, p_idempotency_key TEXT, p_items JSONB)
+RETURNS JSONB AS $$
+DECLARE
+  v_checkout_id TEXT;
+  v_result JSONB;
+  v_item RECORD;
+  v_product RECORD;
+  v_orders JSONB := '[]';
+  v_total DECIMAL(12,2) := 0;
+BEGIN
+  INSERT INTO checkouts (buyer_id, idempotency_key)
+  VALUES (p_buyer_id, p_idempotency_key)
+  ON CONFLICT (buyer_id, idempotency_key) DO NOTHING
+  RETURNING id INTO v_checkout_id;
+
+  IF v_checkout_id IS NULL THEN
+    -- A concurrent call with the same key waits on the unique index above,
+    -- so by now the first call has committed its result
+    SELECT result INTO v_result FROM checkouts
+      WHERE buyer_id = p_buyer_id AND idempotency_key = p_idempotency_key;
+    RETURN v_result || jsonb_build_object('replayed', TRUE);
+  END IF;
+
+  FOR v_item IN
+    SELECT item ->> 'product_id' AS product_id, sum((item ->> 'quantity')::int) AS quantity
+    FROM jsonb_array_elements(p_items) AS item
+    GROUP BY 1
+    ORDER BY 1
+  LOOP
+    IF v_item.quantity IS NULL OR v_item.quantity <= 0 THEN
+      RAISE EXCEPTION 'invalid_quantity' USING ERRCODE = '22023', DETAIL = v_item.product_id;
+    END IF;
+
+    UPDATE products
+      SET stock_quantity = stock_quantity - v_item.quantity
+      WHERE id = v_item.product_id AND stock_quantity >= v_item.quantity
+      RETURNING id, supplier_id, price INTO v_product;
+
+    IF NOT FOUND THEN
+      IF EXISTS (SELECT 1 FROM products WHERE id = v_item.product_id) THEN
+        RAISE EXCEPTION 'insufficient_stock' USING ERRCODE = 'P0409', DETAIL = v_item.product_id;
+      END IF;
+      RAISE EXCEPTION 'product_not_found' USING ERRCODE = 'P0404', DETAIL = v_item.product_id;
+    END IF;
+
+    INSERT INTO orders (buyer_id, seller_id, product_id, checkout_id, quantity, unit_price, total_amount)
+    VALUES (p_buyer_id, v_product.supplier_id, v_product.id, v_checkout_id,
+            v_item.quantity, v_product.price, v_product.price * v_item.quantity)
+    RETURNING jsonb_build_object(
+      'id', id, 'product_id', product_id, 'seller_id', seller_id,
+      'quantity', quantity, 'unit_price', unit_price, 'total_amount', total_amount, 'status', status
+    ) INTO v_result;
+
+    v_orders := v_orders || v_result;
+    v_total := v_total + v_product.price * v_item.quantity;
+  END LOOP;
+
+  IF jsonb_array_length(v_orders) = 0 THEN
+    RAISE EXCEPTION 'empty_cart' USING ERRCODE = '22023';
+  END IF;
+
+  v_result := jsonb_build_object(
+    'checkout_id', v_checkout_id,
+    'orders', v_orders,
+    'total_amount', v_total,
+    'replayed', FALSE
+  );
+  UPDATE checkouts SET result = v_result WHERE id = v_checkout_id;
+  RETURN v_result;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- place_order trusts p_buyer_id, so only the API may call it: PostgREST would
+-- otherwise expose it at /rest/v1/rpc/place_order to anyone with the anon key
+REVOKE EXECUTE ON FUNCTION public.place_order(UUID, TEXT, JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.place_order(UUID, TEXT, JSONB) TO service_role;
+
+-- Analytics rollups (backend/analytics.py) read each event table past a
+-- created_at watermark
+CREATE INDEX IF NOT EXISTS idx_product_likes_created_at ON product_likes(created_at);
+CREATE INDEX IF NOT EXISTS idx_comments_created_at ON comments(created_at);
+CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at);
@@ -0,0 +1,12 @@
+"""Shared test setup: backend modules on the path, asyncio for anyio tests."""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,238 @@
+"""Analytics rollups: bucketing, merging, watermarks and supplier queries."""
+import fcntl
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import analytics
+from analytics import AnalyticsStore
+
+
+class FakeQuery:
+    """The subset of the postgrest builder AnalyticsStore uses."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def select(self, columns):
+        names = [c.strip() for c in columns.split(",")]
+        return FakeQuery([{name: row.get(name) for name in names} for row in self.rows])
+
+    def gt(self, column, value):
+        return FakeQuery([r for r in self.rows if r[column] > value])
+
+    def lte(self, column, value):
+        return FakeQuery([r for r in self.rows if r[column] <= value])
+
+    def eq(self, column, value):
+        return FakeQuery([r for r in self.rows if r[column] == value])
+
+    def in_(self, column, values):
+        return FakeQuery([r for r in self.rows if r[column] in values])
+
+    def order(self, column):
+        return FakeQuery(sorted(self.rows, key=lambda r: r[column]))
+
+    def limit(self, count):
+        return FakeQuery(self.rows[:count])
+
+    def execute(self):
+        return SimpleNamespace(data=self.rows)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.tables = {"products": [], "product_likes": [], "comments": [], "messages": []}
+        self.queries = 0
+        self.fail_after = None
+
+    def table(self, name):
+        self.queries += 1
+        if self.fail_after is not None and self.queries > self.fail_after:
+            raise ConnectionError("upstream down")
+        return FakeQuery(self.tables[name])
+
+    def like(self, product_id, at):
+        self.tables["product_likes"].append({"product_id": product_id, "created_at": at})
+
+    def comment(self, product_id, at):
+        self.tables["comments"].append({"product_id": product_id, "created_at": at})
+
+    def message(self, recipient_id, at, product_id=None):
+        self.tables["messages"].append({"product_id": product_id, "recipient_id": recipient_id, "created_at": at})
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AnalyticsStore(tmp_path)
+
+
+@pytest.fixture
+def supabase():
+    client = FakeSupabase()
+    client.tables["products"] = [
+        {"id": "phone", "supplier_id": "awa"},
+        {"id": "charger", "supplier_id": "awa"},
+        {"id": "wax", "supplier_id": "kofi"},
+    ]
+    return client
+
+
+def stats(store, supplier_id, granularity="hourly", product_id=None):
+    return store.supplier_stats(
+        supplier_id, granularity, datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2025, 1, 1, tzinfo=timezone.utc), product_id
+    )
+
+
+def test_rollup_counts_each_metric_per_bucket():
+    events = pd.DataFrame([
+        {"supplier_id": "awa", "product_id": "phone", "created_at": "2024-05-01T10:05:00+00:00", "metric": "likes"},
+        {"supplier_id": "awa", "product_id": "phone", "created_at": "2024-05-01T10:55:00.5+00:00", "metric": "likes"},
+        {"supplier_id": "awa", "product_id": "phone", "created_at": "2024-05-01T11:00:00+00:00", "metric": "comments"},
+        {"supplier_id": "kofi", "product_id": "", "created_at": "2024-05-01T10:30:00+00:00", "metric": "messages"},
+    ])
+    rollup = AnalyticsStore.rollup(events, "h")
+    assert rollup.to_dict("records") == [
+        {"supplier_id": "awa", "product_id": "phone", "bucket": pd.Timestamp("2024-05-01 10:00", tz="UTC"),
+         "likes": 2, "comments": 0, "messages": 0},
+        {"supplier_id": "awa", "product_id": "phone", "bucket": pd.Timestamp("2024-05-01 11:00", tz="UTC"),
+         "likes": 0, "comments": 1, "messages": 0},
+        {"supplier_id": "kofi", "product_id": "", "bucket": pd.Timestamp("2024-05-01 10:00", tz="UTC"),
+         "likes": 0, "comments": 0, "messages": 1},
+    ]
+
+
+def test_merge_adds_counts_of_the_same_bucket():
+    bucket = pd.Timestamp("2024-05-01 10:00", tz="UTC")
+    existing = pd.DataFrame([{"supplier_id": "awa", "product_id": "phone", "bucket": bucket, "likes": 2, "comments": 1, "messages": 0}])
+    new = pd.DataFrame([
+        {"supplier_id": "awa", "product_id": "phone", "bucket": bucket, "likes": 1, "comments": 0, "messages": 3},
+        {"supplier_id": "awa", "product_id": "charger", "bucket": bucket, "likes": 1, "comments": 0, "messages": 0},
+    ])
+    merged = AnalyticsStore.merge(existing, new).set_index("product_id")
+    assert merged.loc["phone", ["likes", "comments", "messages"]].tolist() == [3, 1, 3]
+    assert merged.loc["charger", "likes"] == 1
+    assert AnalyticsStore.merge(existing, AnalyticsStore.rollup(pd.DataFrame(), "h")) is existing
+
+
+def test_update_is_incremental_past_the_watermarks(store, supabase):
+    supabase.like("phone", "2024-05-01T10:05:00+00:00")
+    supabase.comment("phone", "2024-05-01T10:15:00+00:00")
+    supabase.message("awa", "2024-05-01T10:20:00+00:00", product_id="charger")
+    first = store.update(supabase)
+    assert first["events"] == 3
+    assert first["watermarks"] == {
+        "product_likes": "2024-05-01T10:05:00+00:00",
+        "comments": "2024-05-01T10:15:00+00:00",
+        "messages": "2024-05-01T10:20:00+00:00",
+    }
+
+    supabase.like("phone", "2024-05-01T10:45:00+00:00")
+    supabase.like("wax", "2024-05-02T09:00:00+00:00")
+    second = store.update(supabase)
+    assert second["events"] == 2
+    assert second["watermarks"]["product_likes"] == "2024-05-02T09:00:00+00:00"
+    assert store.update(supabase)["events"] == 0
+
+    awa = stats(store, "awa")
+    assert awa["totals"] == {"likes": 2, "comments": 1, "messages": 1}
+    assert awa["series"] == [{"bucket": "2024-05-01T10:00:00+00:00", "likes": 2, "comments": 1, "messages": 1}]
+    assert [p["product_id"] for p in awa["products"]] == ["phone", "charger"]
+    assert stats(store, "kofi", "daily")["series"] == [
+        {"bucket": "2024-05-02T00:00:00+00:00", "likes": 1, "comments": 0, "messages": 0}
+    ]
+
+
+def test_incremental_updates_match_one_full_update(tmp_path, supabase):
+    times = [f"2024-05-0{day}T{hour:02d}:30:00+00:00" for day in (1, 2) for hour in (8, 9, 17)]
+    incremental, full = AnalyticsStore(tmp_path / "a"), AnalyticsStore(tmp_path / "b")
+    for i, at in enumerate(times):
+        supabase.like(["phone", "charger", "wax"][i % 3], at)
+        supabase.comment("phone", at)
+        incremental.update(supabase)
+    full.update(supabase)
+    for granularity in ("hourly", "daily"):
+        pd.testing.assert_frame_equal(incremental._read(granularity), full._read(granularity))
+
+
+def test_pages_do_not_split_rows_sharing_a_timestamp(tmp_path, supabase, monkeypatch):
+    times = ["2024-05-01T10:00:00+00:00"] + ["2024-05-01T10:30:00+00:00"] * 3 + ["2024-05-01T11:00:00+00:00"]
+    for at in times:
+        supabase.like("phone", at)
+    full = AnalyticsStore(tmp_path / "full")
+    full.update(supabase)
+
+    monkeypatch.setattr(analytics, "PAGE_SIZE", 2)
+    paged = AnalyticsStore(tmp_path / "paged")
+    assert paged.update(supabase)["events"] == len(times)
+    for granularity in ("hourly", "daily"):
+        pd.testing.assert_frame_equal(paged._read(granularity), full._read(granularity))
+
+
+def test_watermarks_advance_with_each_saved_batch(store, supabase, monkeypatch):
+    monkeypatch.setattr(analytics, "PAGE_SIZE", 2)
+    monkeypatch.setattr(analytics, "ANALYTICS_BATCH_SIZE", 2)
+    for hour in range(8, 14):
+        supabase.like("phone", f"2024-05-01T{hour:02d}:00:00+00:00")
+
+    # Each full page takes a query for its ties; the third page fails
+    supabase.fail_after = 5
+    with pytest.raises(ConnectionError):
+        store.update(supabase)
+    assert store._watermarks() == {"product_likes": "2024-05-01T11:00:00+00:00"}
+    assert stats(store, "awa")["totals"]["likes"] == 4
+
+    supabase.fail_after = None
+    assert store.update(supabase)["events"] == 2
+    assert stats(store, "awa")["totals"]["likes"] == 6
+
+
+def test_messages_without_products_are_rolled_up(store, supabase):
+    # No event in the batch maps to a known product
+    supabase.message("awa", "2024-05-01T10:00:00+00:00")
+    supabase.message("awa", "2024-05-01T10:10:00+00:00", product_id="deleted-product")
+    result = store.update(supabase)
+    assert result["events"] == 2
+    assert result["watermarks"]["messages"] == "2024-05-01T10:10:00+00:00"
+
+    awa = stats(store, "awa")
+    assert awa["totals"] == {"likes": 0, "comments": 0, "messages": 2}
+    assert awa["products"] == [{"product_id": "deleted-product", "likes": 0, "comments": 0, "messages": 1}]
+
+
+def test_events_of_unknown_products_are_dropped(store, supabase):
+    supabase.like("deleted-product", "2024-05-01T10:00:00+00:00")
+    result = store.update(supabase)
+    assert result["events"] == 0
+    assert result["watermarks"]["product_likes"] == "2024-05-01T10:00:00+00:00"
+
+
+def test_recent_events_wait_for_the_lag(store, supabase, monkeypatch):
+    monkeypatch.setattr(analytics, "ANALYTICS_LAG_SECONDS", 3600)
+    supabase.like("phone", datetime.now(timezone.utc).isoformat())
+    assert store.update(supabase)["events"] == 0
+    monkeypatch.setattr(analytics, "ANALYTICS_LAG_SECONDS", 0)
+    assert store.update(supabase)["events"] == 1
+
+
+def test_supplier_stats_filters_by_range_and_product(store, supabase):
+    supabase.like("phone", "2024-05-01T10:00:00+00:00")
+    supabase.like("charger", "2024-05-01T12:00:00+00:00")
+    supabase.like("charger", "2024-06-01T12:00:00+00:00")
+    store.update(supabase)
+
+    may = store.supplier_stats(
+        "awa", "hourly", datetime(2024, 5, 1, tzinfo=timezone.utc), datetime(2024, 5, 2, tzinfo=timezone.utc)
+    )
+    assert may["totals"]["likes"] == 2
+    assert stats(store, "awa", product_id="charger")["totals"]["likes"] == 2
+    assert stats(store, "nobody") == {"totals": {"likes": 0, "comments": 0, "messages": 0}, "series": [], "products": []}
+
+
+def test_update_is_skipped_while_another_process_holds_the_lock(store, supabase):
+    store.directory.mkdir(parents=True, exist_ok=True)
+    with open(store.path(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert store.update(supabase) == {"skipped": True}
@@ -0,0 +1,173 @@
+"""Compression middleware: negotiation, size thresholds and streaming."""
+import asyncio
+import gzip
+import json
+
+import pytest
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+import compression
+from compression import CompressionMiddleware, choose_encoding, parse_accept_encoding
+
+brotli = pytest.importorskip("brotli")
+
+pytestmark = pytest.mark.anyio
+
+LARGE = {"products": [{"id": str(i), "image_base64": "iVBORw0KGgo" * 40} for i in range(50)]}
+
+
+async def request(app, accept_encoding="gzip, br", path="/api/products", **options):
+    """Run one request through the middleware; return (status, headers, body messages)."""
+    middleware = CompressionMiddleware(app, **options)
+    scope = {
+        "type": "http", "method": "GET", "path": path, "query_string": b"",
+        "headers": [(b"accept-encoding", accept_encoding.encode())] if accept_encoding is not None else [],
+    }
+    messages, requested = [], []
+
+    async def receive():
+        if requested:
+            await asyncio.Event().wait()  # like a server: nothing more until disconnect
+        requested.append(True)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, receive, send)
+    start, *bodies = messages
+    headers = {k.decode(): v.decode() for k, v in start["headers"]}
+    return start["status"], headers, bodies
+
+
+def decode(headers, data):
+    encoding = headers.get("content-encoding")
+    if encoding == "br":
+        return brotli.decompress(data)
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    return data
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate, br", "br"),
+    ("gzip", "gzip"),
+    ("br;q=0.5, gzip;q=0.8", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("*", "br"),
+    ("*;q=0.1, br;q=0", "gzip"),
+    ("identity", None),
+    ("gzip;q=0", None),
+    ("gzip;q=oops", None),
+    ("", None),
+])
+def test_encoding_negotiation(header, expected):
+    assert choose_encoding(header) == expected
+
+
+def test_accept_encoding_parsing():
+    assert parse_accept_encoding(" GZIP ;q=0.5,, br") == {"gzip": 0.5, "br": 1.0}
+
+
+def test_gzip_is_used_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert choose_encoding("br, gzip") == "gzip"
+    assert choose_encoding("br") is None
+
+
+async def test_large_json_is_compressed():
+    for accept, encoding in [("br", "br"), ("gzip", "gzip")]:
+        status, headers, [body] = await request(JSONResponse(LARGE), accept)
+        assert status == 200
+        assert headers["content-encoding"] == encoding
+        assert headers["vary"] == "Accept-Encoding"
+        assert int(headers["content-length"]) == len(body["body"])
+        assert json.loads(decode(headers, body["body"])) == LARGE
+
+
+async def test_small_bodies_and_unaccepted_encodings_are_left_alone():
+    small = JSONResponse({"ok": True})
+    _, headers, [body] = await request(small)
+    assert "content-encoding" not in headers
+    assert body["body"] == b'{"ok":true}'
+
+    for accept in (None, "identity"):
+        _, headers, [body] = await request(JSONResponse(LARGE), accept)
+        assert "content-encoding" not in headers
+        assert json.loads(body["body"]) == LARGE
+
+
+async def test_incompressible_and_encoded_responses_pass_through():
+    png = Response(b"\x89PNG" + b"\x00" * 4096, media_type="image/png")
+    _, headers, [body] = await request(png)
+    assert "content-encoding" not in headers
+    assert len(body["body"]) == 4100
+
+    already = Response(gzip.compress(b"x" * 4096), media_type="text/plain", headers={"Content-Encoding": "gzip"})
+    _, headers, [body] = await request(already, "br")
+    assert headers["content-encoding"] == "gzip"
+    assert gzip.decompress(body["body"]) == b"x" * 4096
+
+
+async def test_large_bodies_are_compressed_in_the_threadpool(monkeypatch):
+    offloaded = []
+
+    async def run_in_threadpool(fn, *args):
+        offloaded.append(len(args[0]))
+        return fn(*args)
+
+    monkeypatch.setattr(compression, "run_in_threadpool", run_in_threadpool)
+    _, headers, [body] = await request(JSONResponse(LARGE), "gzip", offload_size=4096)
+    assert offloaded == [len(json.dumps(LARGE, separators=(",", ":")))]
+    assert json.loads(decode(headers, body["body"])) == LARGE
+
+    await request(JSONResponse(LARGE), "gzip", offload_size=10 ** 9)
+    assert len(offloaded) == 1
+
+
+async def test_streaming_responses_are_compressed_incrementally():
+    chunks = [json.dumps({"row": i, "data": "x" * 500}).encode() + b"\n" for i in range(20)]
+
+    async def rows():
+        for chunk in chunks:
+            yield chunk
+
+    for accept in ("br", "gzip"):
+        _, headers, bodies = await request(StreamingResponse(rows(), media_type="application/x-ndjson"), accept)
+        assert "content-encoding" not in headers  # not a compressible type
+
+        _, headers, bodies = await request(StreamingResponse(rows(), media_type="text/plain"), accept)
+        assert headers["content-encoding"] == accept
+        assert "content-length" not in headers
+        assert bodies[-1]["more_body"] is False
+        assert decode(headers, b"".join(b["body"] for b in bodies)) == b"".join(chunks)
+
+
+async def test_large_streamed_chunks_are_compressed_in_the_threadpool(monkeypatch):
+    offloaded = []
+
+    async def run_in_threadpool(fn, *args):
+        offloaded.append(len(args[0]))
+        return fn(*args)
+
+    chunks = [b"a" * 100, b"b" * 8192, b"c" * 4096, b"d" * 10]
+
+    async def rows():
+        for chunk in chunks:
+            yield chunk
+
+    monkeypatch.setattr(compression, "run_in_threadpool", run_in_threadpool)
+    _, headers, bodies = await request(StreamingResponse(rows(), media_type="text/plain"), "gzip", offload_size=4096)
+    assert offloaded == [8192, 4096]
+    assert decode(headers, b"".join(b["body"] for b in bodies)) == b"".join(chunks)
+
+
+async def test_route_levels_use_the_longest_prefix():
+    middleware = CompressionMiddleware(
+        JSONResponse({}), levels={"gzip": 4},
+        route_levels={"/api": {"gzip": 1}, "/api/products": {"br": 11}},
+    )
+    assert middleware.level_for("/api/products/1", "br") == 11
+    assert middleware.level_for("/api/products/1", "gzip") == 1
+    assert middleware.level_for("/health", "gzip") == 4
+    assert middleware.level_for("/health", "br") == compression.DEFAULT_LEVELS["br"]
@@ -0,0 +1,144 @@
+"""Request profiling: selection, overhead path, storage and exports."""
+import json
+import time
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+pytest.importorskip("pyinstrument")
+
+import profiling  # noqa: E402
+from profiling import ProfilingMiddleware, RequestProfiler, collapsed_stacks, render  # noqa: E402
+
+TOKEN = "s3cret-token"
+
+
+def busy(seconds=0.02):
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += sum(range(200))
+    return total
+
+
+def profile_call(fn, *args):
+    profiler = profiling.Profiler(interval=0.0005)
+    profiler.start()
+    fn(*args)
+    return profiler.stop()
+
+
+async def work(request):
+    return JSONResponse({"total": busy()})
+
+
+async def health(request):
+    return JSONResponse({"ok": True})
+
+
+@pytest.fixture
+def profiler(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", TOKEN)
+    monkeypatch.setattr(profiling, "PROFILE_INTERVAL", 0.0005)
+    monkeypatch.delenv("PROFILE_SAMPLE_RATE", raising=False)
+    monkeypatch.delenv("PROFILE_ROUTES", raising=False)
+    return RequestProfiler(tmp_path)
+
+
+@pytest.fixture
+def client(profiler):
+    app = Starlette(routes=[Route("/api/work", work), Route("/api/health", health)])
+    return TestClient(ProfilingMiddleware(app, profiler))
+
+
+def test_token_alone_does_not_arm_the_profiler(profiler, client, monkeypatch):
+    assert profiler.armed is False
+
+    def fail(scope):
+        raise AssertionError("wants() runs only when a rate or routes are set")
+
+    monkeypatch.setattr(profiler, "wants", fail)
+    response = client.get("/api/work")
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert list(profiler.profiles()) == []
+
+
+def test_requests_with_the_token_are_profiled(profiler, client):
+    assert "x-profile-id" not in client.get("/api/work", headers={"X-Profile": "wrong"}).headers
+    response = client.get("/api/work", headers={"X-Profile": TOKEN})
+    profile_id = response.headers["x-profile-id"]
+
+    [record] = profiler.profiles()
+    assert record["meta"]["id"] == profile_id
+    assert (record["meta"]["method"], record["meta"]["path"], record["meta"]["status"]) == ("GET", "/api/work", 200)
+    assert profiler.get(profile_id) is not None
+    assert profiler.get("../settings") is None
+
+
+def test_header_is_ignored_without_a_configured_token(profiler, client, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "")
+    assert "x-profile-id" not in client.get("/api/work", headers={"X-Profile": ""}).headers
+    assert profiler.is_admin("") is False
+
+
+def test_routes_and_sample_rate_select_requests(profiler, client):
+    profiler.configure(routes=["/api/work"])
+    assert profiler.armed
+    assert "x-profile-id" in client.get("/api/work").headers
+    assert "x-profile-id" not in client.get("/api/health").headers
+
+    profiler.configure(sample_rate=1.0, routes=[])
+    assert "x-profile-id" in client.get("/api/health").headers
+    profiler.configure(sample_rate=0.0)
+    assert profiler.armed is False
+    assert "x-profile-id" not in client.get("/api/health").headers
+
+
+def test_settings_reach_other_workers(profiler, tmp_path):
+    other = RequestProfiler(tmp_path)
+    profiler.configure(sample_rate=0.25, routes=["/api/products"])
+    other.reload_settings()
+    assert (other.sample_rate, other.routes, other.armed) == (0.25, ["/api/products"], True)
+
+    profiler.configure(sample_rate=0.0, routes=[])
+    time.sleep(0.01)  # distinct mtime
+    other.reload_settings()
+    assert other.armed is False
+
+
+def test_only_the_most_recent_profiles_are_kept(profiler, client, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_KEEP", 2)
+    ids = []
+    for _ in range(3):
+        ids.append(client.get("/api/health", headers={"X-Profile": TOKEN}).headers["x-profile-id"])
+        time.sleep(0.002)  # profiles are named by millisecond
+    assert [r["meta"]["id"] for r in profiler.profiles()] == ids[:0:-1]
+
+
+def test_collapsed_stacks_count_exclusive_time_once():
+    session = profile_call(busy, 0.05)
+    lines = collapsed_stacks(session).splitlines()
+    stacks = [line.rsplit(" ", 1)[0] for line in lines]
+    assert len(stacks) == len(set(stacks))
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+    assert any("busy (" in stack for stack in stacks)
+    assert not any("<thread>" in stack for stack in stacks)
+    total = sum(int(line.rsplit(" ", 1)[1]) for line in lines)
+    assert total <= session.duration * 1_000_000 * 1.01
+
+
+def test_profiles_of_a_route_are_merged(profiler, client):
+    for _ in range(2):
+        client.get("/api/work", headers={"X-Profile": TOKEN})
+    client.get("/api/health", headers={"X-Profile": TOKEN})
+
+    merged = profiler.aggregate("/api/work", window=60)
+    assert merged.duration >= 0.04
+    assert profiler.aggregate("/api/missing", window=60) is None
+    for fmt in profiling.EXPORT_FORMATS:
+        assert render(merged, fmt)
+    assert "shared" in json.loads(render(merged, "speedscope"))
@@ -0,0 +1,154 @@
+"""Similar-products index: top-k, location boosts, tombstones and rebuilds."""
+
+import pytest
+
+import recommendations
+from recommendations import SimilarityIndex, catalog_terms, product_terms
+
+
+def product(product_id, name, category="Électronique", description="", city="Douala", country="Cameroun"):
+    return {
+        "id": product_id, "name": name, "description": description, "category": category,
+        "supplier_city": city, "supplier_country": country,
+    }
+
+
+CATALOG = [
+    product("tecno", "Téléphone Tecno Spark", description="Smartphone double SIM"),
+    product("itel", "Téléphone Itel A70", description="Smartphone double SIM"),
+    product("samsung", "Téléphone Samsung Galaxy", description="Smartphone", city="Dakar", country="Sénégal"),
+    product("charger", "Chargeur rapide", description="Pour smartphone"),
+    product("wax", "Pagne wax", category="Mode", description="Tissu 6 yards"),
+    product("bag", "Sac tissé", category="Mode", description="Tissu"),
+]
+
+
+@pytest.fixture
+def index():
+    index = SimilarityIndex()
+    index.rebuild(CATALOG)
+    return index
+
+
+def ids(scored):
+    return [product_id for product_id, _ in scored]
+
+
+def test_terms_are_accent_and_case_insensitive():
+    terms = product_terms(product("x", "TÉLÉPHONE Tecno", category="Électronique"))
+    assert {"telephone", "tecno", "telephone tecno", "cat:electronique"} <= set(terms)
+
+
+def test_catalog_terms_match_product_terms():
+    catalog = CATALOG + [
+        product("empty", "", category="", description=None),
+        product("one", "Radio", description="radio RADIO Radio-réveil"),
+        product("mixed", "Crème ÉCLAT x2 Œuvre", description="crème\nkarité, 100% naturel"),
+        {"id": "bare", "name": None},
+    ]
+    rows, term_ids, tfs, vocabulary = catalog_terms(catalog)
+    by_row = [{} for _ in catalog]
+    for row, term_id, tf in zip(rows, term_ids, tfs):
+        by_row[row][vocabulary[term_id]] = tf
+    assert by_row == [dict(product_terms(p)) for p in catalog]
+    assert [len(a) for a in catalog_terms([])[:3]] == [0, 0, 0]
+
+
+def test_rebuilt_vectors_match_upserted_ones(index):
+    for product_ in CATALOG:
+        row = index.rows[product_["id"]]
+        expected = index._vectorise(product_terms(product_))
+        assert index.vectors[row] == pytest.approx(expected, abs=1e-6)
+
+
+def test_top_k_is_ordered_by_score(index):
+    scored = index.similar("tecno", k=3)
+    assert ids(scored)[:2] == ["itel", "samsung"]
+    assert [score for _, score in scored] == sorted((score for _, score in scored), reverse=True)
+    assert "tecno" not in ids(index.similar("tecno", k=10))
+    assert len(index.similar("tecno", k=2)) == 2
+
+
+def test_same_city_is_boosted(index, monkeypatch):
+    itel = dict(index.similar("tecno"))["itel"]
+    monkeypatch.setattr(recommendations, "CITY_BOOST", 0.0)
+    monkeypatch.setattr(recommendations, "COUNTRY_BOOST", 0.0)
+    assert dict(index.similar("tecno"))["itel"] == pytest.approx(itel - 0.15)
+
+
+def test_unknown_products_have_no_neighbours(index):
+    assert index.similar("missing") == []
+    assert index.similar_many(["tecno", "missing"], k=2)["missing"] == []
+    assert SimilarityIndex().similar("tecno") == []
+
+
+def test_batched_queries_match_single_ones(index):
+    batch = index.similar_many(["tecno", "wax"], k=3)
+    for product_id in ("tecno", "wax"):
+        single = index.similar(product_id, k=3)
+        assert ids(batch[product_id]) == ids(single)
+        assert [score for _, score in batch[product_id]] == pytest.approx([score for _, score in single])
+
+
+def test_removed_products_are_tombstoned(index):
+    index.remove("itel")
+    assert "itel" not in ids(index.similar("tecno", k=10))
+    assert index.similar("itel") == []
+    assert index.stats()["tombstones"] == 1
+
+    index.rebuild([p for p in CATALOG if p["id"] != "itel"])
+    assert index.stats() | {"matrix_mb": None} == {
+        "ready": True, "products": 5, "tombstones": 0, "dim": recommendations.DIM, "matrix_mb": None,
+    }
+
+
+def test_upsert_adds_and_updates_products(index):
+    index.upsert(product("nokia", "Téléphone Nokia", description="Smartphone double SIM"))
+    assert "nokia" in ids(index.similar("tecno", k=3))
+
+    index.upsert(product("nokia", "Pagne wax hollandais", category="Mode", description="Tissu"))
+    assert "nokia" not in ids(index.similar("tecno", k=3))
+    assert ids(index.similar("wax", k=1)) == ["nokia"]
+
+
+def test_index_grows_past_its_capacity():
+    index = SimilarityIndex()
+    index.rebuild([])
+    for i in range(1500):
+        index.upsert(product(f"p{i}", f"Produit {i}"))
+    assert index.stats()["products"] == 1500
+    assert len(index.similar("p0", k=5)) == 5
+
+
+def test_writes_during_a_rebuild_are_kept(index):
+    index.begin_rebuild()
+    snapshot = [dict(p) for p in CATALOG]  # read before the writes below
+    index.upsert(product("nokia", "Téléphone Nokia", description="Smartphone double SIM"))
+    index.remove("itel")
+    index.rebuild(snapshot)
+
+    neighbours = ids(index.similar("tecno", k=10))
+    assert "nokia" in neighbours
+    assert "itel" not in neighbours
+    assert index.stats()["products"] == 6
+
+
+def test_writes_while_the_snapshot_is_vectorised_are_kept():
+    index = SimilarityIndex()
+    index.rebuild(CATALOG)
+
+    def snapshot():
+        # Another request writes while rebuild is consuming the catalog
+        yield from CATALOG[:3]
+        index.upsert(product("nokia", "Téléphone Nokia", description="Smartphone double SIM"))
+        index.remove("wax")
+        yield from CATALOG[3:]
+
+    index.rebuild(snapshot())
+    assert "nokia" in ids(index.similar("tecno", k=10))
+    assert index.similar("wax") == []
+
+    # Recording stops with the swap
+    index.upsert(product("radio", "Radio FM"))
+    index.rebuild(CATALOG)
+    assert index.similar("radio") == []
@@ -0,0 +1,246 @@
+"""Resilience layer: breaker, stale fallback, deadlines and coalesced reads."""
+import asyncio
+import time
+
+import httpx
+import pytest
+from postgrest.exceptions import APIError
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import resilience
+from resilience import (
+    DeadlineExceeded,
+    DeadlineMiddleware,
+    RequestBudget,
+    Upstream,
+    UpstreamUnavailable,
+    current_budget,
+    execute_read,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def fast_settings(monkeypatch):
+    monkeypatch.setattr(resilience, "ATTEMPT_TIMEOUT", 0.2)
+    monkeypatch.setattr(resilience, "BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(resilience, "BREAKER_RESET_SECONDS", 0.1)
+    monkeypatch.setattr(resilience, "HEDGING", False)
+    monkeypatch.setattr(resilience, "upstream", Upstream())
+
+
+def with_deadline(ms, coro):
+    """Run ``coro`` in its own task under a request budget of ``ms``."""
+
+    async def run():
+        resilience._budget.set(RequestBudget(time.monotonic() + ms / 1000))
+        result = await coro
+        return result, current_budget().served_stale
+
+    return asyncio.ensure_future(run())
+
+
+def down():
+    raise httpx.ConnectError("connection refused")
+
+
+def failing(code):
+    def call():
+        raise APIError({"code": code, "message": "error"})
+
+    return call
+
+
+def slow(seconds, result="rows"):
+    def call():
+        time.sleep(seconds)
+        return result
+
+    return call
+
+
+class FakeQuery:
+    """Just enough of a postgrest request builder for execute_read."""
+
+    http_method = "GET"
+    path = "/products"
+    headers = {}
+
+    def __init__(self, execute, product_id="1"):
+        self.execute = execute
+        self.params = httpx.QueryParams({"id": f"eq.{product_id}"})
+
+
+async def test_breaker_opens_after_consecutive_failures():
+    upstream = Upstream()
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD):
+        with pytest.raises(UpstreamUnavailable):
+            await upstream.call(down, "products:post", idempotent=False)
+    assert upstream.breaker("products:post").state == "open"
+
+    calls = []
+    with pytest.raises(UpstreamUnavailable):
+        await upstream.call(lambda: calls.append(1), "products:post", idempotent=False)
+    assert calls == []
+    assert upstream.counters["rejected"] == 1
+
+
+async def test_reads_are_retried_before_counting_as_down():
+    upstream, attempts = Upstream(), []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            down()
+        return "rows"
+
+    assert await upstream.call(flaky, "products:get", idempotent=True) == "rows"
+    assert upstream.counters["retries"] == 2
+    assert upstream.breaker("products:get").state == "closed"
+
+
+async def test_half_open_allows_one_probe_and_closes_on_success():
+    upstream = Upstream()
+    breaker = upstream.breaker("products:post")
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD):
+        breaker.record_failure()
+    await asyncio.sleep(resilience.BREAKER_RESET_SECONDS)
+    assert breaker.state == "half_open"
+
+    probe = asyncio.ensure_future(upstream.call(slow(0.05), "products:post", idempotent=False))
+    await asyncio.sleep(0.01)
+    with pytest.raises(UpstreamUnavailable):
+        await upstream.call(slow(0), "products:post", idempotent=False)
+    assert await probe == "rows"
+    assert breaker.state == "closed"
+
+
+async def test_failed_probe_reopens_the_breaker():
+    upstream = Upstream()
+    breaker = upstream.breaker("products:post")
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD):
+        breaker.record_failure()
+    await asyncio.sleep(resilience.BREAKER_RESET_SECONDS)
+
+    with pytest.raises(UpstreamUnavailable):
+        await upstream.call(down, "products:post", idempotent=False)
+    assert breaker.state == "open"
+    assert breaker.times_opened == 1
+
+
+async def test_open_breaker_serves_the_last_good_read():
+    upstream = Upstream()
+    assert await upstream.call(slow(0, "old rows"), "products:get", True, cache_key="q") == "old rows"
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD):
+        upstream.breaker("products:get").record_failure()
+
+    assert await upstream.call(down, "products:get", True, cache_key="q") == "old rows"
+    assert current_budget().served_stale is False  # outside a request: a fresh budget
+    assert upstream.counters["stale_served"] == 1
+    with pytest.raises(UpstreamUnavailable):
+        await upstream.call(down, "products:get", True, cache_key="other")
+
+
+@pytest.mark.parametrize("code", [503, "502", "504", "PGRST000", "PGRST001", "PGRST003", "57014"])
+async def test_postgrest_errors_of_an_unwell_upstream_are_failures(code):
+    upstream = Upstream()
+    assert await upstream.call(slow(0, "old rows"), "products:get", True, cache_key="q") == "old rows"
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD):
+        with pytest.raises(UpstreamUnavailable):
+            await upstream.call(failing(code), "products:get", True, cache_key="other")
+    assert upstream.counters["retries"] > 0
+    assert upstream.breaker("products:get").state == "open"
+    assert await upstream.call(failing(code), "products:get", True, cache_key="q") == "old rows"
+
+
+@pytest.mark.parametrize("code", ["PGRST116", "22P02", "23505", "42501", 404, "400"])
+async def test_postgrest_errors_of_a_bad_query_are_answers(code):
+    upstream = Upstream()
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD + 1):
+        with pytest.raises(APIError):
+            await upstream.call(failing(code), "products:get", True, cache_key="q")
+    assert upstream.breaker("products:get").state == "closed"
+    assert upstream.counters["retries"] == 0
+
+
+async def test_attempt_timeout_counts_as_a_failure():
+    upstream = Upstream()
+    with pytest.raises(DeadlineExceeded):
+        await upstream.call(slow(0.3), "products:get", idempotent=True)
+    assert upstream.breaker("products:get").failures == resilience.READ_ATTEMPTS
+
+
+async def test_short_client_deadlines_do_not_open_the_breaker():
+    upstream = Upstream()
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD + 2):
+        task = with_deadline(5, upstream.call(slow(0.05), "products:get", idempotent=True))
+        with pytest.raises(DeadlineExceeded):
+            await task
+    assert upstream.breaker("products:get").state == "closed"
+    assert upstream.breaker("products:get").failures == 0
+    assert upstream.counters["retries"] == 0
+
+    result, _ = await with_deadline(8000, upstream.call(slow(0.01), "products:get", idempotent=True))
+    assert result == "rows"
+
+
+async def test_spent_budget_fails_without_calling_upstream():
+    calls = []
+    task = with_deadline(0, resilience.upstream.call(lambda: calls.append(1), "products:get", True))
+    with pytest.raises(DeadlineExceeded):
+        await task
+    assert calls == []
+
+
+async def test_coalesced_read_does_not_inherit_the_leader_deadline():
+    calls = []
+
+    def query():
+        calls.append(1)
+        time.sleep(0.05)
+        return "rows"
+
+    leader = with_deadline(10, execute_read(FakeQuery(query)))
+    await asyncio.sleep(0)
+    followers = [with_deadline(8000, execute_read(FakeQuery(query))) for _ in range(5)]
+
+    with pytest.raises(DeadlineExceeded):
+        await leader
+    assert [result for result, _ in await asyncio.gather(*followers)] == ["rows"] * 5
+    assert len(calls) == 1
+
+
+async def test_coalesced_callers_are_all_flagged_stale():
+    assert await execute_read(FakeQuery(slow(0, "old rows"))) == "old rows"
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD):
+        resilience.upstream.breaker("products:get").record_failure()
+
+    # Both callers share one call, answered from the stale cache
+    tasks = [with_deadline(8000, execute_read(FakeQuery(down))) for _ in range(2)]
+    assert await asyncio.gather(*tasks) == [("old rows", True)] * 2
+    assert resilience.upstream.counters["stale_served"] == 1
+
+
+def test_middleware_applies_client_deadline_and_flags_stale_responses():
+    budgets = []
+
+    async def endpoint(request):
+        budget = current_budget()
+        budgets.append(budget.remaining())
+        budget.served_stale = request.query_params.get("stale") == "1"
+        return JSONResponse({})
+
+    client = TestClient(DeadlineMiddleware(Starlette(routes=[Route("/", endpoint)])))
+    assert "x-served-stale" not in client.get("/").headers
+    assert client.get("/", headers={"X-Request-Deadline-Ms": "50"}).status_code == 200
+    assert client.get("/", headers={"X-Request-Deadline-Ms": "999999"}).status_code == 200
+    assert client.get("/?stale=1").headers["x-served-stale"] == "1"
+
+    default = resilience.REQUEST_DEADLINE_MS / 1000
+    assert default - 1 < budgets[0] <= default
+    assert budgets[1] <= 0.05
+    assert default - 1 < budgets[2] <= default
@@ -0,0 +1,199 @@
+"""Server wiring: warm-up, health checks and how storage errors reach clients."""
+import asyncio
+import signal
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from postgrest.exceptions import APIError
+
+import server
+from storage import SupabaseStorage
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def warmup(monkeypatch):
+    """A fresh warmup_state, with checks that fail until told to pass."""
+    monkeypatch.setattr(server, "warmup_state", {
+        **server.warmup_state, "ready": False, "draining": False, "upstream": "unknown", "storage": "unknown"
+    })
+    monkeypatch.setattr(server.asyncio, "sleep", fast_sleep)
+    state = SimpleNamespace(upstream_up=False, storage_up=False, calls={"upstream": 0, "storage": 0})
+
+    def query():
+        state.calls["upstream"] += 1
+        if not state.upstream_up:
+            raise ConnectionError("upstream down")
+
+    async def connect():
+        state.calls["storage"] += 1
+        if not state.storage_up:
+            raise OSError("could not connect to Postgres")
+
+    monkeypatch.setattr(server, "get_supabase", lambda: SimpleNamespace(table=lambda name: SimpleNamespace(
+        select=lambda columns: SimpleNamespace(limit=lambda n: SimpleNamespace(execute=query))
+    )))
+    monkeypatch.setattr(server, "storage", SimpleNamespace(connect=connect))
+    return state
+
+
+_sleep = asyncio.sleep
+
+
+async def fast_sleep(delay):
+    await _sleep(0.001)
+
+
+async def wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return
+        await _sleep(0.002)
+    raise AssertionError("condition never became true")
+
+
+async def get(path):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.get(path)
+
+
+async def test_ready_is_503_until_the_upstream_check_passes(warmup):
+    warmup.storage_up = True
+    task = asyncio.ensure_future(server.become_ready())
+    await wait_for(lambda: warmup.calls["upstream"] >= 2)
+    response = await get("/api/health/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "warming_up"
+    assert response.json()["upstream"] == "unreachable: ConnectionError"
+    assert (await get("/api/health/live")).status_code == 200
+
+    warmup.upstream_up = True
+    await asyncio.wait_for(task, 1)
+    response = await get("/api/health/ready")
+    assert response.status_code == 200
+    assert response.json()["upstream"] == "ok"
+    assert response.json()["ready_at"] is not None
+
+
+async def test_live_is_200_while_warming_up_and_draining(warmup):
+    assert (await get("/api/health/live")).json() == {"status": "ok"}
+    server.start_draining()
+    assert (await get("/api/health/live")).status_code == 200
+    response = await get("/api/health/ready")
+    assert (response.status_code, response.json()["status"]) == (503, "draining")
+
+
+async def test_a_draining_worker_never_turns_ready(warmup):
+    warmup.upstream_up = warmup.storage_up = True
+    server.start_draining()
+    await asyncio.wait_for(server.become_ready(), 1)
+    assert server.warmup_state["ready"] is False
+
+
+async def test_static_responses_are_primed_at_startup(warmup, monkeypatch):
+    async def idle():
+        await asyncio.Event().wait()
+
+    for name in ("become_ready", "refresh_similarity_index", "refresh_analytics", "watch_profiling_settings"):
+        monkeypatch.setattr(server, name, idle)
+    monkeypatch.setattr(server, "drain_on_sigterm", lambda: None)
+    monkeypatch.setattr(server, "_static_bodies", {})
+
+    await server.warm_up()
+    try:
+        assert set(server._static_bodies) == {"categories", "locations"}
+        response = await get("/api/categories")
+        assert response.content == server._static_bodies["categories"]
+        assert response.json() == {"categories": server.CATEGORIES}
+    finally:
+        for name in ("warmup_task", "similarity_task", "analytics_task", "profiling_task"):
+            task = getattr(server.app.state, name, None)
+            if task is not None:
+                task.cancel()
+
+
+def test_sigterm_fails_readiness_before_the_server_drains(warmup):
+    received = []
+    original = signal.signal(signal.SIGTERM, lambda signum, frame: received.append(signum))
+    try:
+        server.warmup_state["ready"] = True
+        server.drain_on_sigterm()
+        signal.raise_signal(signal.SIGTERM)
+        assert received == [signal.SIGTERM]  # the server's own handler still runs
+        assert (server.warmup_state["ready"], server.warmup_state["draining"]) == (False, True)
+    finally:
+        signal.signal(signal.SIGTERM, original)
+
+
+async def test_worker_is_not_ready_until_storage_connects(warmup):
+    warmup.upstream_up = True
+    task = asyncio.ensure_future(server.become_ready())
+    await wait_for(lambda: warmup.calls["storage"] >= 3)
+    assert server.warmup_state["upstream"] == "ok"
+    assert server.warmup_state["storage"] == "unreachable: OSError"
+    assert server.warmup_state["ready"] is False
+
+    warmup.storage_up = True
+    await asyncio.wait_for(task, 1)
+    assert server.warmup_state["storage"] == "ok"
+    assert server.warmup_state["ready"] is True
+
+
+async def test_worker_is_not_ready_until_upstream_answers(warmup):
+    warmup.storage_up = True
+    task = asyncio.ensure_future(server.become_ready())
+    await wait_for(lambda: warmup.calls["upstream"] >= 3)
+    assert (server.warmup_state["storage"], server.warmup_state["ready"]) == ("ok", False)
+
+    warmup.upstream_up = True
+    await asyncio.wait_for(task, 1)
+    assert server.warmup_state["ready"] is True
+
+
+# Unknown columns are the client's error on both backends -------------------
+
+
+class UnknownColumnQuery:
+    """A postgrest builder whose execute fails as PostgREST does for a missing column."""
+
+    http_method = "PATCH"
+    path = "/profiles"
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        raise APIError({
+            "code": "PGRST204", "message": "Could not find the 'no_such_column' column of 'profiles' in the schema cache",
+        })
+
+
+@pytest.fixture
+def api(monkeypatch):
+    user = SimpleNamespace(id="user-1", email="user@example.com")
+    server.app.dependency_overrides[server.get_current_user] = lambda: user
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+def postgres_backend():
+    postgres_storage = pytest.importorskip("postgres_storage")
+    backend = postgres_storage.PostgresStorage("postgresql://unused")
+    backend.pool = object()  # connected; the column check comes first
+    backend.columns = {"profiles": {"id", "city", "phone"}}
+    return backend
+
+
+@pytest.mark.parametrize("backend", [
+    lambda: SupabaseStorage(lambda: SimpleNamespace(table=lambda name: UnknownColumnQuery())),
+    postgres_backend,
+], ids=["supabase", "postgres"])
+def test_unknown_column_is_a_client_error(api, monkeypatch, backend):
+    monkeypatch.setattr(server, "storage", backend())
+    response = api.put("/api/profile", json={"no_such_column": 1})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Could not find the 'no_such_column' column of 'profiles' in the schema cache"
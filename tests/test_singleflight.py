@@ -0,0 +1,96 @@
+"""Single-flight coalescing: sharing, failures and cancellation."""
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+class Upstream:
+    """A slow call that counts how often it really runs."""
+
+    def __init__(self, result="rows", error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def start(flight, upstream, n, key="products?id=eq.1"):
+    tasks = [asyncio.ensure_future(flight.do(key, upstream, label="products")) for _ in range(n)]
+    await asyncio.sleep(0)
+    return tasks
+
+
+async def test_concurrent_callers_share_one_call():
+    flight, upstream = SingleFlight(), Upstream()
+    tasks = await start(flight, upstream, 5)
+    upstream.release.set()
+
+    assert await asyncio.gather(*tasks) == ["rows"] * 5
+    assert upstream.calls == 1
+    assert flight.stats()["coalesced"] == 4
+    assert flight.stats()["coalesced_by_table"] == {"products": 4}
+    assert flight.stats()["inflight"] == 0
+
+
+async def test_different_keys_are_not_shared():
+    flight, upstream = SingleFlight(), Upstream()
+    upstream.release.set()
+    await asyncio.gather(flight.do("a", upstream), flight.do("b", upstream))
+    assert upstream.calls == 2
+
+
+async def test_calls_after_completion_run_again():
+    flight, upstream = SingleFlight(), Upstream()
+    upstream.release.set()
+    await flight.do("a", upstream)
+    await asyncio.sleep(0)
+    await flight.do("a", upstream)
+    assert upstream.calls == 2
+
+
+async def test_failure_reaches_every_caller():
+    flight, upstream = SingleFlight(), Upstream(error=ValueError("bad filter"))
+    tasks = await start(flight, upstream, 3)
+    upstream.release.set()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+    assert upstream.calls == 1
+    assert flight.stats()["inflight"] == 0
+
+
+async def test_cancelled_leader_does_not_cancel_followers():
+    flight, upstream = SingleFlight(), Upstream()
+    leader, *followers = await start(flight, upstream, 4)
+
+    leader.cancel()
+    await asyncio.sleep(0)
+    upstream.release.set()
+
+    assert await asyncio.gather(*followers) == ["rows"] * 3
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert upstream.calls == 1
+
+
+async def test_cancelled_follower_does_not_cancel_the_call():
+    flight, upstream = SingleFlight(), Upstream()
+    leader, follower = await start(flight, upstream, 2)
+
+    follower.cancel()
+    await asyncio.sleep(0)
+    upstream.release.set()
+
+    assert await leader == "rows"
+    assert follower.cancelled()
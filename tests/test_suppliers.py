@@ -0,0 +1,128 @@
+"""Supplier directory endpoint: filters, keyset pagination and cursors."""
+import string
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from postgrest import SyncPostgrestClient
+from postgrest.utils import SyncClient
+
+import server
+from server import decode_cursor, encode_cursor
+
+
+def supplier(n, name, country="Cameroun", city="Douala"):
+    supplier_id = f"00000000-0000-0000-0000-00000000000{n}"
+    return {
+        "supplier_id": supplier_id, "display_name": name, "country": country, "city": city,
+        "avatar_url": None, "is_supplier_verified": False, "product_count": n, "total_likes": 0,
+        "categories": [], "sample_products": [], "sort_key": f"{name.lower()} {supplier_id}",
+    }
+
+
+URL_SAFE = set(string.ascii_letters + string.digits + "-_=")
+
+DIRECTORY = [
+    supplier(1, "Awa Couture"),
+    supplier(2, "Kofi Électronique", city="Yaoundé"),
+    supplier(3, "Aminata Wax", country="Sénégal", city="Dakar"),
+    supplier(4, "Bakary Awa", city="Yaoundé"),
+    supplier(5, "Ébène Bois"),
+]
+
+
+def postgrest(rows, requests):
+    """A PostgREST over ``rows``: the eq/gt/ilike filters, order and limit the endpoint uses."""
+
+    def handle(request):
+        requests.append(request)
+        params = request.url.params
+        result = list(rows)
+        for column, value in params.multi_items():
+            if column in ("select", "order", "limit"):
+                continue
+            op, _, operand = value.partition(".")
+            if op == "eq":
+                result = [r for r in result if r[column] == operand]
+            elif op == "gt":
+                result = [r for r in result if r[column] > operand]
+            elif op == "ilike":
+                result = [r for r in result if operand.strip("%").lower() in r[column].lower()]
+        result.sort(key=lambda r: r[params["order"]])
+        columns = [c.strip() for c in params["select"].split(",")]
+        return httpx.Response(200, json=[{c: r[c] for c in columns} for r in result[:int(params["limit"])]])
+
+    class Client(SyncPostgrestClient):
+        def create_session(self, base_url, headers, timeout):
+            return SyncClient(base_url=base_url, headers=headers, timeout=timeout, transport=httpx.MockTransport(handle))
+
+    return Client("http://postgrest.test")
+
+
+@pytest.fixture
+def api(monkeypatch):
+    requests = []
+    client = postgrest(DIRECTORY, requests)
+    monkeypatch.setattr(server, "get_supabase", lambda: client)
+    api = TestClient(server.app)
+    api.requests = requests
+    return api
+
+
+def names(response):
+    return [s["display_name"] for s in response.json()["suppliers"]]
+
+
+def test_cursor_round_trips_any_sort_key():
+    for sort_key in ["awa couture 00000000-0000-0000-0000-000000000001", "ébène bois ?&/+", ""]:
+        cursor = encode_cursor(sort_key)
+        assert decode_cursor(cursor) == sort_key
+        assert set(cursor) <= URL_SAFE
+
+
+def test_pages_follow_the_sort_key_until_the_last(api):
+    seen, cursor = [], None
+    for _ in range(3):
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = api.get("/api/suppliers", params=params).json()
+        seen += [s["display_name"] for s in page["suppliers"]]
+        assert page["count"] == len(page["suppliers"])
+        assert all("sort_key" not in s for s in page["suppliers"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == sorted((s["display_name"] for s in DIRECTORY), key=str.lower)
+    assert cursor is None
+
+
+def test_a_full_last_page_has_no_next_cursor(api):
+    response = api.get("/api/suppliers", params={"limit": len(DIRECTORY)})
+    assert response.json()["count"] == len(DIRECTORY)
+    assert response.json()["next_cursor"] is None
+    # One extra row is asked for to tell whether another page follows
+    assert api.requests[-1].url.params["limit"] == str(len(DIRECTORY) + 1)
+
+
+@pytest.mark.parametrize("params, expected", [
+    ({"country": "Sénégal"}, ["Aminata Wax"]),
+    ({"country": "Cameroun", "city": "Yaoundé"}, ["Bakary Awa", "Kofi Électronique"]),
+    ({"name": "awa"}, ["Awa Couture", "Bakary Awa"]),
+    ({"name": "awa", "city": "Douala"}, ["Awa Couture"]),
+    ({"city": "Garoua"}, []),
+])
+def test_filters_narrow_the_directory(api, params, expected):
+    assert names(api.get("/api/suppliers", params=params)) == expected
+
+
+def test_filters_apply_to_every_page(api):
+    first = api.get("/api/suppliers", params={"city": "Yaoundé", "limit": 1}).json()
+    second = api.get("/api/suppliers", params={"city": "Yaoundé", "limit": 1, "cursor": first["next_cursor"]}).json()
+    assert [s["display_name"] for s in first["suppliers"] + second["suppliers"]] == ["Bakary Awa", "Kofi Électronique"]
+    assert second["next_cursor"] is None
+
+
+@pytest.mark.parametrize("cursor", ["abc", "_w==", "!!!", "a b"], ids=["padding", "not-utf8", "alphabet", "space"])
+def test_bad_cursor_is_a_client_error(api, cursor):
+    response = api.get("/api/suppliers", params={"cursor": cursor})
+    assert (response.status_code, response.json()["detail"]) == (400, "Invalid cursor")
+    assert api.requests == []
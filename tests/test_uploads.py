@@ -0,0 +1,309 @@
+"""Multipart product uploads: limits, type checks and malformed bodies."""
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import uploads
+from uploads import parse_product_multipart
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 56
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 60
+PRODUCT = {"name": "Pagne wax", "description": "6 yards", "price": 12.5, "category": "Mode", "stock_quantity": 4}
+BOUNDARY = "test-boundary"
+
+
+app = FastAPI()
+
+
+@app.post("/")
+async def echo(request: Request):
+    fields, image = await parse_product_multipart(request)
+    body = {"fields": fields, "image": None}
+    if image is not None:
+        body["image"] = {"type": image.content_type, "size": image.size, "data": image.file.read().hex()}
+        image.close()
+    return body
+
+
+client = TestClient(app)
+
+
+def multipart_body(*parts):
+    """Raw multipart body from (name, content type, bytes) parts."""
+    body = b""
+    for name, content_type, data in parts:
+        body += f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{name}\"".encode()
+        if name == "image":
+            body += b'; filename="photo"'
+        body += f"\r\nContent-Type: {content_type}\r\n\r\n".encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def post(body, **headers):
+    return client.post("/", content=body, headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}", **headers})
+
+
+def product_part(fields=PRODUCT):
+    return ("product", "application/json", json.dumps(fields).encode())
+
+
+def test_product_fields_and_image_are_parsed():
+    response = post(multipart_body(product_part(), ("image", "image/png", PNG)))
+    assert response.status_code == 200
+    assert response.json() == {"fields": PRODUCT, "image": {"type": "image/png", "size": len(PNG), "data": PNG.hex()}}
+
+
+def test_image_is_optional():
+    response = post(multipart_body(product_part()))
+    assert response.json() == {"fields": PRODUCT, "image": None}
+
+
+def test_oversized_image_is_rejected(monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_IMAGE_BYTES", 32)
+    response = post(multipart_body(product_part(), ("image", "image/png", PNG)))
+    assert response.status_code == 413
+
+
+def test_oversized_content_length_is_rejected_before_reading(monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_IMAGE_BYTES", 0)
+    body = b"x" * (uploads.MAX_FIELDS_BYTES + 16 * 1024 + 1)
+    assert post(body).status_code == 413
+
+
+def test_oversized_product_part_is_rejected():
+    fields = {**PRODUCT, "description": "x" * uploads.MAX_FIELDS_BYTES}
+    assert post(multipart_body(product_part(fields))).status_code == 413
+
+
+@pytest.mark.parametrize("content_type, data", [
+    ("image/svg+xml", b"<svg xmlns='http://www.w3.org/2000/svg'/>"),
+    ("image/png", JPEG),
+    ("image/png", b"\x89PN"),
+], ids=["unsupported", "mismatch", "truncated"])
+def test_image_type_is_checked_against_content(content_type, data):
+    response = post(multipart_body(product_part(), ("image", content_type, data)))
+    assert response.status_code == 415
+
+
+@pytest.mark.parametrize("body, detail", [
+    (multipart_body(("image", "image/png", PNG)), "Missing 'product' part"),
+    (multipart_body(product_part(), ("image", "image/png", PNG), ("image", "image/png", PNG)), "Only one image part is allowed"),
+    (multipart_body(product_part(), ("image", "image/png", b"")), "Image part is empty"),
+    (multipart_body(("product", "application/json", b"{not json")), "The product part must be valid JSON"),
+    (multipart_body(("product", "application/json", b"[1]")), "The product part must be a JSON object"),
+], ids=["no-product", "two-images", "empty-image", "bad-json", "not-object"])
+def test_invalid_parts_are_rejected(body, detail):
+    response = post(body)
+    assert (response.status_code, response.json()["detail"]) == (400, detail)
+
+
+@pytest.mark.parametrize("body", [
+    b"not a multipart body",
+    f"--{BOUNDARY}X\r\n".encode(),
+    f"--{BOUNDARY}\r\nbad header line\r\n\r\n".encode(),
+], ids=["no-boundary", "bad-boundary", "bad-header"])
+def test_malformed_body_is_rejected(body):
+    response = post(body)
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Malformed multipart body")
+
+
+def test_missing_boundary_is_rejected():
+    response = client.post("/", content=b"", headers={"Content-Type": "multipart/form-data"})
+    assert response.status_code == 400
+
+
+def test_non_numeric_content_length_is_rejected():
+    assert post(multipart_body(product_part()), **{"Content-Length": "12abc"}).status_code == 400
+
+
+# Product endpoints ----------------------------------------------------------
+
+
+class FakeStorage:
+    def __init__(self, supplier_id):
+        self.supplier_id = supplier_id
+        self.created = []
+        self.products = {"p1": {"id": "p1", "supplier_id": supplier_id, "image_url": "https://cdn.example.com/old.png"}}
+        self.error = None
+
+    async def get_profile(self, user_id):
+        return {"id": user_id, "user_type": "supplier", "country": "Cameroun", "city": "Douala"}
+
+    async def create_product(self, supplier_id, fields):
+        if self.error:
+            raise self.error
+        self.created.append({**fields, "supplier_id": supplier_id})
+        return self.created[-1]
+
+    async def get_product_owner(self, product_id):
+        return self.supplier_id
+
+    async def get_product(self, product_id):
+        return self.products.get(product_id)
+
+    async def update_product(self, product_id, supplier_id, fields):
+        if self.error:
+            raise self.error
+        if product_id not in self.products:
+            return None
+        self.products[product_id].update(fields)
+        return self.products[product_id]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    import server
+
+    user = SimpleNamespace(id="supplier-1")
+    fake = FakeStorage(user.id)
+    uploaded = []
+
+    removed = []
+
+    async def store_product_image(supabase, supplier_id, product_id, image):
+        uploaded.append((supabase, image.content_type, image.size))
+        return f"https://cdn.example.com/{product_id}.png"
+
+    async def remove_product_image(supabase, image_url):
+        if image_url is not None:
+            removed.append(image_url)
+
+    monkeypatch.setattr(server, "storage", fake)
+    monkeypatch.setattr(server, "store_product_image", store_product_image)
+    monkeypatch.setattr(server, "remove_product_image", remove_product_image)
+    monkeypatch.setattr(server, "get_service_supabase", lambda: "service client")
+    monkeypatch.setattr(server.similarity_index, "upsert", lambda product: None)
+    server.app.dependency_overrides[server.get_current_user] = lambda: user
+    yield SimpleNamespace(client=TestClient(server.app), storage=fake, uploaded=uploaded, removed=removed)
+    server.app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("body", [b"[1]", b'"text"', b"null", b"{oops"], ids=["list", "string", "null", "invalid"])
+@pytest.mark.parametrize("method, path", [("POST", "/api/products"), ("PUT", "/api/products/p1")])
+def test_non_object_json_body_is_a_client_error(api, method, path, body):
+    response = api.client.request(method, path, content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+
+
+def test_malformed_multipart_body_is_a_client_error(api):
+    response = api.client.post(
+        "/api/products", content=b"not a multipart body",
+        headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+    )
+    assert response.status_code == 400
+    assert api.storage.created == []
+
+
+def test_multipart_product_is_uploaded_with_the_service_client(api):
+    response = api.client.post(
+        "/api/products", content=multipart_body(product_part(), ("image", "image/png", PNG)),
+        headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+    )
+    assert response.status_code == 200
+    assert api.uploaded == [("service client", "image/png", len(PNG))]
+    assert response.json()["image_url"].endswith(".png")
+    assert response.json()["supplier_id"] == "supplier-1"
+
+
+def send_product(api, method, path):
+    return api.client.request(
+        method, path, content=multipart_body(product_part(), ("image", "image/png", PNG)),
+        headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+    )
+
+
+def test_image_is_removed_when_the_product_is_not_created(api):
+    api.storage.error = ConnectionError("upstream down")
+    response = send_product(api, "POST", "/api/products")
+    assert response.status_code == 500
+    assert len(api.uploaded) == 1
+    assert len(api.removed) == 1 and api.removed[0].endswith(".png")
+
+
+@pytest.mark.parametrize("error", [ConnectionError("upstream down"), None], ids=["failed", "not-found"])
+def test_image_is_removed_when_the_product_is_not_updated(api, error):
+    api.storage.error = error
+    path = "/api/products/p1" if error else "/api/products/gone"
+    response = send_product(api, "PUT", path)
+    assert response.status_code == (500 if error else 404)
+    assert api.removed == [f"https://cdn.example.com/{path.rsplit('/', 1)[1]}.png"]
+
+
+def test_replacing_an_image_removes_the_previous_one(api):
+    response = send_product(api, "PUT", "/api/products/p1")
+    assert response.status_code == 200
+    assert response.json()["image_url"] == "https://cdn.example.com/p1.png"
+    assert api.removed == ["https://cdn.example.com/old.png"]
+
+
+def test_update_without_an_image_keeps_the_current_one(api):
+    response = api.client.put("/api/products/p1", json={"price": 10})
+    assert response.status_code == 200
+    assert api.removed == []
+
+
+# Supabase Storage ------------------------------------------------------------
+
+
+class FakeBucket:
+    base_url = "https://project.supabase.co/storage/v1/"
+
+    def __init__(self, error=None):
+        self.error = error
+        self.objects = {}
+
+    def from_(self, bucket):
+        assert bucket == uploads.PRODUCT_IMAGES_BUCKET
+        return self
+
+    def upload(self, path, file, options):
+        if self.error:
+            raise self.error
+        self.objects[path] = file.read()
+
+    def remove(self, paths):
+        for path in paths:
+            self.objects.pop(path, None)
+
+    def get_public_url(self, path):
+        return f"{self.base_url}object/public/{uploads.PRODUCT_IMAGES_BUCKET}/{path}?"
+
+
+def spooled(data):
+    image = uploads.ImageUpload("image/png")
+    image.write(data)
+    image.finish()
+    return image
+
+
+@pytest.mark.anyio
+async def test_stored_image_can_be_removed_by_its_url():
+    supabase = SimpleNamespace(storage=FakeBucket())
+    image = spooled(PNG)
+    url = await uploads.store_product_image(supabase, "supplier-1", "p1", image)
+    image.close()
+    path = uploads.product_image_path(url)
+    assert path.startswith("supplier-1/p1/") and path.endswith(".png")
+    assert supabase.storage.objects == {path: PNG}
+
+    await uploads.remove_product_image(supabase, "https://cdn.example.com/elsewhere.png")
+    assert path in supabase.storage.objects
+    await uploads.remove_product_image(supabase, url)
+    assert supabase.storage.objects == {}
+
+
+@pytest.mark.anyio
+async def test_failed_upload_counts_as_an_upstream_failure(monkeypatch):
+    import resilience
+
+    monkeypatch.setattr(resilience, "upstream", resilience.Upstream())
+    image = spooled(PNG)
+    with pytest.raises(resilience.UpstreamUnavailable):
+        await uploads.store_product_image(SimpleNamespace(storage=FakeBucket(httpx.ConnectError("reset"))), "s", "p", image)
+    image.close()
+    assert resilience.upstream.breaker("storage:upload").failures == 1